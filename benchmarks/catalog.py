@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+# License: Apache-2.0
+# Copyright (C) 2020 Mikhail f. Shiryaev
+
+"""
+Synthetic catalogs of ClickHouse tables and a fake client serving them
+"""
+
+from random import Random
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from clickhouse_plantuml.sources import COLUMNS_FIELDS, TABLES_FIELDS
+
+TableRow = Tuple[Any, ...]
+ColumnRow = Tuple[Any, ...]
+
+# Every MERGE_EVERY group has a Merge table over the group
+MERGE_EVERY = 50
+
+TYPES = (
+    "String",
+    "UInt64",
+    "Int32",
+    "Float64",
+    "DateTime",
+    "LowCardinality(String)",
+    "Array(String)",
+    "Nullable(UInt32)",
+    "Decimal(18, 4)",
+    "Map(String, String)",
+)
+
+
+class Catalog(object):
+    """
+    Rows of **system.tables** and **system.columns** of a synthetic server.
+    Tables are generated in groups like production ones:
+
+    - `events_N_local` ReplicatedMergeTree with the data
+    - `events_N` Distributed over it
+    - `events_N_buffer` Buffer over the Distributed one
+    - `events_N_agg_mv` MaterializedView `TO events_N_agg`, the latter is
+      ReplicatedAggregatingMergeTree
+    - `events_N_daily` MaterializedView with the `.inner.events_N_daily`
+      SummingMergeTree
+    - `all_events_N` Merge table over the group, for every 50th group
+
+    Groups are spread over databases round-robin. Most tables have 5-30
+    columns, every tenth is wide with 100-300 columns. The same arguments
+    give the same catalog
+
+    Parameters
+    ----------
+    tables : `int`
+        number of tables, the last group is cut to fit
+    databases : `int`
+        number of databases
+    seed : `int`
+        the seed of the random widths and types
+    """
+
+    def __init__(self, tables: int, databases: int = 10, seed: int = 0):
+        self.random = Random(seed)
+        self.databases = ["db_{}".format(i) for i in range(max(databases, 1))]
+        rows = []  # type: List[TableRow]
+        columns = {}  # type: Dict[Tuple[str, str], List[ColumnRow]]
+        group = 0
+        while len(rows) < tables:
+            database = self.databases[group % len(self.databases)]
+            for row, table_columns in self._group(database, group):
+                rows.append(row)
+                columns[(row[0], row[1])] = table_columns
+            group += 1
+
+        rows = sorted(rows[:tables], key=lambda r: (r[0], r[1]))
+        self.tables = rows
+        self.columns = [c for r in rows for c in columns[(r[0], r[1])]]
+        self.tables_by_database = {
+            d: [] for d in self.databases
+        }  # type: Dict[str, List[TableRow]]
+        for r in self.tables:
+            self.tables_by_database[r[0]].append(r)
+        self.columns_by_database = {
+            d: [] for d in self.databases
+        }  # type: Dict[str, List[ColumnRow]]
+        for c in self.columns:
+            self.columns_by_database[c[0]].append(c)
+
+    def _group(
+        self, db: str, n: int
+    ) -> Iterator[Tuple[TableRow, List[ColumnRow]]]:
+        local = "events_{}_local".format(n)
+        events = self._columns(self._width())
+        zoo_path = "'/clickhouse/tables/{{shard}}/{}.{}', '{{replica}}'"
+        keys = ("toYYYYMM(date)", "id, date", "id, date", "")
+        yield self._table(
+            db,
+            local,
+            "ReplicatedMergeTree",
+            "ReplicatedMergeTree({}) PARTITION BY toYYYYMM(date) "
+            "ORDER BY (id, date) SETTINGS index_granularity = 8192".format(
+                zoo_path.format(db, local)
+            ),
+            keys,
+            events,
+            [
+                "{}.events_{}_agg_mv".format(db, n),
+                "{}.events_{}_daily".format(db, n),
+            ],
+        )
+        yield self._table(
+            db,
+            "events_{}".format(n),
+            "Distributed",
+            "Distributed('cluster', '{}', '{}', cityHash64(id))".format(
+                db, local
+            ),
+            ("", "", "", ""),
+            events,
+        )
+        yield self._table(
+            db,
+            "events_{}_buffer".format(n),
+            "Buffer",
+            "Buffer('{}', 'events_{}', 16, 10, 100, 10000, 1000000, "
+            "10000000, 100000000)".format(db, n),
+            ("", "", "", ""),
+            events,
+        )
+        agg = "events_{}_agg".format(n)
+        aggregated = events[: max(len(events) // 4, 3)]
+        yield self._table(
+            db,
+            agg,
+            "ReplicatedAggregatingMergeTree",
+            "ReplicatedAggregatingMergeTree({}) PARTITION BY toYYYYMM(date) "
+            "ORDER BY (id, date)".format(zoo_path.format(db, agg)),
+            keys,
+            aggregated,
+        )
+        yield self._table(
+            db,
+            "events_{}_agg_mv".format(n),
+            "MaterializedView",
+            "",
+            ("", "", "", ""),
+            aggregated,
+            query="CREATE MATERIALIZED VIEW {0}.events_{1}_agg_mv TO "
+            "{0}.{2} AS SELECT * FROM {0}.{3}".format(db, n, agg, local),
+        )
+        daily = events[:3]
+        yield self._table(
+            db,
+            "events_{}_daily".format(n),
+            "MaterializedView",
+            "",
+            ("", "", "", ""),
+            daily,
+            query="CREATE MATERIALIZED VIEW {0}.events_{1}_daily "
+            "ENGINE = SummingMergeTree() ORDER BY (id, date) AS "
+            "SELECT id, date, count() FROM {0}.{2}".format(db, n, local),
+        )
+        yield self._table(
+            db,
+            ".inner.events_{}_daily".format(n),
+            "SummingMergeTree",
+            "SummingMergeTree() PARTITION BY toYYYYMM(date) "
+            "ORDER BY (id, date)",
+            keys,
+            daily,
+        )
+        if n % MERGE_EVERY == 0:
+            yield self._table(
+                db,
+                "all_events_{}".format(n),
+                "Merge",
+                "Merge('{}', '^events_{}_')".format(db, n),
+                ("", "", "", ""),
+                events,
+            )
+
+    def _width(self) -> int:
+        if self.random.random() < 0.1:
+            return self.random.randint(100, 300)
+        return self.random.randint(5, 30)
+
+    def _columns(self, width: int) -> List[Tuple[str, str]]:
+        names = [("id", "UInt64"), ("date", "Date")]
+        names.extend(
+            ("column_{}".format(i), self.random.choice(TYPES))
+            for i in range(width - 2)
+        )
+        return names
+
+    @staticmethod
+    def _table(
+        db: str,
+        name: str,
+        engine: str,
+        engine_full: str,
+        keys: Sequence[str],
+        columns: List[Tuple[str, str]],
+        dependencies: Sequence[str] = (),
+        query: str = "",
+    ) -> Tuple[TableRow, List[ColumnRow]]:
+        query = query or "CREATE TABLE {}.{} ENGINE = {}".format(
+            db, name, engine_full
+        )
+        row = (db, name, list(dependencies), query, engine, engine_full)
+        row += tuple(keys)
+        # `date` is in partition and sorting keys, `id` only in sorting one
+        in_keys = {}  # type: Dict[str, Tuple[int, ...]]
+        if keys[0]:
+            in_keys = {"date": (1, 1, 1, 0), "id": (0, 1, 1, 0)}
+        column_rows = [
+            (db, name, c, t, "", "", "", "") + in_keys.get(c, (0, 0, 0, 0))
+            for c, t in columns
+        ]
+        return row, column_rows
+
+
+class CatalogClient(object):
+    """
+    Fake client answering queries of :class:`ClickHouseSource` from the
+    catalog. Rows are filtered by databases and `(database, table)` pairs,
+    inlined or sent as the external table. Pairs of the whole catalog are
+    not checked one by one
+
+    Parameters
+    ----------
+    catalog : `Catalog`
+    """
+
+    def __init__(self, catalog: Catalog):
+        self.catalog = catalog
+
+    def _rows(
+        self, query: str, params: Dict[str, Any]
+    ) -> Tuple[List[Tuple[Any, ...]], Sequence[str]]:
+        if "pairs" in params:
+            databases = sorted({p[0] for p in params["pairs"]})
+        else:
+            databases = sorted(params.get("ds") or self.catalog.databases)
+        if "system.columns" in query:
+            by_database = self.catalog.columns_by_database
+            fields = COLUMNS_FIELDS  # type: Sequence[str]
+        else:
+            by_database = self.catalog.tables_by_database
+            fields = TABLES_FIELDS
+        rows = [r for d in databases for r in by_database.get(d, ())]
+        pairs = params.get("pairs")
+        if pairs is not None and len(pairs) != len(self.catalog.tables):
+            selected = set(pairs)
+            rows = [r for r in rows if (r[0], r[1]) in selected]
+        if "create_table_query" not in query and fields is TABLES_FIELDS:
+            # Names of tables for Merge tables
+            rows = [r[:2] for r in rows]
+            fields = ("database", "name")
+        return rows, fields
+
+    @staticmethod
+    def _params(params, external_tables) -> Dict[str, Any]:
+        params = dict(params or {})
+        for table in external_tables or ():
+            if table["name"] == "_pairs":
+                params["pairs"] = [
+                    (r["database"], r["table"]) for r in table["data"]
+                ]
+        return params
+
+    def execute_iter_rows(
+        self, query, params=None, row_factory=None, external_tables=None
+    ):
+        rows, fields = self._rows(query, self._params(params, external_tables))
+        make_row = None if row_factory is None else row_factory(list(fields))
+        if make_row is None:
+            return iter(rows)
+        return map(make_row, rows)
+
+    def execute_columnar(self, query, params=None, external_tables=None):
+        rows, fields = self._rows(query, self._params(params, external_tables))
+        return [list(f) for f in zip(*rows)], list(fields)
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+# License: Apache-2.0
+# Copyright (C) 2020 Mikhail f. Shiryaev
+
+"""
+Benchmarks of loading tables and generating diagrams of synthetic catalogs,
+see :class:`Catalog`. Run from the repository root:
+
+    python -m benchmarks.run --json baseline.json
+    python -m benchmarks.run --baseline baseline.json
+
+The whole load and the diagram generation are timed with the profiler
+disabled. Phases inside the load are taken from the profiler spans of a
+separate run, since timing of every fetched row slows the load down. Every
+time is the best of `--repeat` runs. Memory is traced by tracemalloc in one
+more run: the size of loaded tables and the peaks of both steps
+"""
+
+import json
+import platform
+import sys
+import tracemalloc
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, Namespace
+from collections import OrderedDict
+from time import perf_counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from clickhouse_plantuml import ClickHouseSource, Tables
+from clickhouse_plantuml.plantuml import plantuml_tables
+from clickhouse_plantuml.timing import profiler
+
+from .catalog import Catalog, CatalogClient
+
+# Spans of the load measured by the profiler
+PHASES = (
+    "query system.tables",
+    "query system.columns",
+    "build tables",
+    "parse_engine",
+    "resolve merges",
+    "add columns",
+    "merge matviews",
+)
+
+
+def load(catalog: Catalog, columnar: bool) -> Tables:
+    source = ClickHouseSource(CatalogClient(catalog), columnar)
+    return Tables(source, catalog.databases)
+
+
+def measure(catalog: Catalog, columnar: bool) -> Dict[str, float]:
+    start = perf_counter()
+    tables = load(catalog, columnar)
+    loaded = perf_counter()
+    plantuml_tables(tables)
+    seconds = {"load": loaded - start, "plantuml": perf_counter() - loaded}
+
+    profiler.reset()
+    profiler.enabled = True
+    try:
+        load(catalog, columnar)
+    finally:
+        profiler.enabled = False
+    seconds.update(
+        (name, profiler.spans[name].seconds)
+        for name in PHASES
+        if name in profiler.spans
+    )
+    profiler.reset()
+    return seconds
+
+
+def measure_memory(catalog: Catalog, columnar: bool) -> Dict[str, int]:
+    """
+    Returns bytes allocated by the loaded tables and the peaks of the load
+    and the diagram generation. The catalog itself is not counted
+    """
+    tracemalloc.start()
+    try:
+        tables = load(catalog, columnar)
+        retained, load_peak = tracemalloc.get_traced_memory()
+        # Restarting resets the peak
+        tracemalloc.stop()
+        tracemalloc.start()
+        plantuml_tables(tables)
+        _, plantuml_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return OrderedDict(
+        [
+            ("tables", retained),
+            ("load peak", load_peak),
+            ("plantuml peak", plantuml_peak),
+        ]
+    )
+
+
+def run(args: Namespace) -> Dict[str, Any]:
+    results = OrderedDict()  # type: Dict[str, Any]
+    for size in args.tables:
+        catalog = Catalog(size, args.databases, args.seed)
+        best = {}  # type: Dict[str, float]
+        for _ in range(max(args.repeat, 1)):
+            for name, seconds in measure(catalog, args.columnar).items():
+                best[name] = min(seconds, best.get(name, seconds))
+        result = OrderedDict(
+            [
+                ("tables", len(catalog.tables)),
+                ("columns", len(catalog.columns)),
+                ("seconds", best),
+            ]
+        )
+        if not args.no_memory:
+            result["memory"] = measure_memory(catalog, args.columnar)
+        results[str(size)] = result
+    return OrderedDict(
+        [
+            ("python", platform.python_version()),
+            ("columnar", args.columnar),
+            ("results", results),
+        ]
+    )
+
+
+def compare(value: float, base: Optional[float], threshold: float) -> str:
+    if not base:
+        return ""
+    change = value / base - 1
+    mark = " !" if change > threshold else ""
+    return " {:+7.1%}{}".format(change, mark)
+
+
+def report(
+    data: Dict[str, Any],
+    baseline: Optional[Dict[str, Any]] = None,
+    threshold: float = 0.2,
+) -> Tuple[List[str], List[str]]:
+    """
+    Returns report lines and the list of regressions above the threshold
+    """
+    lines = []
+    regressions = []
+    base_results = (baseline or {}).get("results", {})
+    for size, result in data["results"].items():
+        base = base_results.get(size, {})
+        lines.append(
+            "{} tables, {} columns".format(result["tables"], result["columns"])
+        )
+        for name, seconds in result["seconds"].items():
+            base_seconds = base.get("seconds", {}).get(name)
+            diff = compare(seconds, base_seconds, threshold)
+            if diff.endswith("!"):
+                regressions.append("{}: {}".format(size, name))
+            lines.append("  {:<24} {:>10.3f} s{}".format(name, seconds, diff))
+        for name, size_bytes in result.get("memory", {}).items():
+            base_bytes = base.get("memory", {}).get(name)
+            diff = compare(size_bytes, base_bytes, threshold)
+            if diff.endswith("!"):
+                regressions.append("{}: {} memory".format(size, name))
+            lines.append(
+                "  {:<24} {:>10.1f} MiB{}".format(
+                    name + " memory", size_bytes / (1 << 20), diff
+                )
+            )
+    return lines, regressions
+
+
+def parse_args() -> Namespace:
+    parser = ArgumentParser(
+        prog="python -m benchmarks.run",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+        description="Measures loading of tables and generating of diagrams "
+        "on synthetic catalogs",
+    )
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        type=int,
+        default=[1000, 10000, 100000],
+        help="sizes of catalogs",
+    )
+    parser.add_argument(
+        "--databases",
+        default=10,
+        type=int,
+        help="number of databases in every catalog",
+    )
+    parser.add_argument(
+        "--seed",
+        default=0,
+        type=int,
+        help="seed of catalogs, the same seed gives the same catalogs",
+    )
+    parser.add_argument(
+        "--repeat",
+        default=3,
+        type=int,
+        help="number of runs, the best time is taken",
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="load tables as ClickHouseSource in columnar mode",
+    )
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="do not measure memory, it's the slowest run",
+    )
+    parser.add_argument(
+        "--json",
+        help="file to write results, e.g. to use as `--baseline` later",
+    )
+    parser.add_argument(
+        "--baseline",
+        help="file with results of a previous run to compare with",
+    )
+    parser.add_argument(
+        "--threshold",
+        default=0.2,
+        type=float,
+        help="relative growth of time or memory against the baseline "
+        "reported as a regression, the exit code is 1 then",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    data = run(args)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(data, f, indent=2)
+    lines, regressions = report(data, baseline, args.threshold)
+    print("\n".join(lines))
+    if regressions:
+        print("Regressions: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,11 +3,27 @@
 # License: Apache-2.0
 # Copyright (C) 2020 Mikhail f. Shiryaev
 
-from .client import Client
+from .client import Client, ClientPool
 from .column import Column
 from .table import Table
+from .sources import Source, ClickHouseSource, DumpSource, Patterns
 from .tables import Tables
+from .graph import DependencyGraph
+from .async_tables import AsyncTables
 from .version import __version__
 
 
-__all__ = ["Client", "Column", "Table", "Tables", "__version__"]
+__all__ = [
+    "Client",
+    "ClientPool",
+    "Column",
+    "Table",
+    "Source",
+    "ClickHouseSource",
+    "DumpSource",
+    "Patterns",
+    "Tables",
+    "DependencyGraph",
+    "AsyncTables",
+    "__version__",
+]
@@ -6,12 +6,15 @@
 """
 The scrip accepts ClickHouse credentials, databases and tables, and produces
 the PlantULM schema description. Optionally it could invoke `plantuml` and
-create the graphical output.
+create the graphical output. With the `serve` command it runs the HTTP
+service with diagrams, see `clickhouse-plantuml serve --help`.
 """
 
 import logging
 import sys
 
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from argparse import (
     ArgumentParser,
     ArgumentDefaultsHelpFormatter,
@@ -19,12 +22,18 @@ from argparse import (
     FileType,
 )
 from hashlib import sha1
-from os.path import isfile, splitext
+from os.path import curdir, dirname, isfile, relpath, splitext
 from pprint import pformat
-from subprocess import Popen, PIPE
+from time import sleep
+from typing import Dict, List, Optional, TextIO, Tuple
 
-from . import Client, Tables
-from .plantuml import plantuml_tables
+from . import Client, ClickHouseSource, DumpSource, Patterns, Tables
+from .graph import split_tables
+from .plantuml import TableMemo, plantuml_tables, write_plantuml_tables
+from .client import split_host
+from .render import DEFAULT_CACHE_DIR, RenderCache, RenderPool, write_file
+from .server import main as serve
+from .timing import profiler
 
 logger = logging.getLogger("clickhouse-plantuml")
 formatter = logging.Formatter(
@@ -51,14 +60,23 @@ def parse_args() -> Namespace:
     clickhouse = parser.add_argument_group("ClickHouse parameters")
     clickhouse.add_argument(
         "--host",
-        default="localhost",
-        help="ClickHouse server hostname",
+        action="append",
+        dest="hosts",
+        default=[],
+        help="ClickHouse server hostname, `host:port` is accepted as well. "
+        "Could be used multiple times, then a diagram is generated per host. "
+        "If omitted, `localhost` is used",
+    )
+    clickhouse.add_argument(
+        "--hosts-file",
+        type=FileType("r"),
+        help="file with ClickHouse hosts, one per line",
     )
     clickhouse.add_argument(
         "--port",
         default=9000,
         type=int,
-        help="ClickHouse server hostname",
+        help="ClickHouse server port",
     )
     clickhouse.add_argument(
         "-u",
@@ -89,6 +107,78 @@ def parse_args() -> Namespace:
         help="tables whitelist to describe. If set, only mentioned tables will"
         "be queried from the server",
     )
+    clickhouse.add_argument(
+        "--database-pattern",
+        action="append",
+        dest="database_patterns",
+        default=[],
+        help="regular expression for databases to describe, matched on the "
+        "server by `match()`. Could be used multiple times. If set, "
+        "`--database` does not default to `default`",
+    )
+    clickhouse.add_argument(
+        "--table-pattern",
+        action="append",
+        dest="table_patterns",
+        default=[],
+        help="regular expression for tables to describe, matched on the "
+        "server by `match()`. Could be used multiple times",
+    )
+    clickhouse.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        help="regular expression for `database.table` names to skip, matched "
+        "on the server by `match()`. Could be used multiple times",
+    )
+    clickhouse.add_argument(
+        "--focus",
+        action="append",
+        default=[],
+        metavar="DATABASE.TABLE",
+        help="table to describe with its neighbours: tables it depends on "
+        "or that depend on it, Distributed and Buffer targets, "
+        "MaterializedView data tables. Could be used multiple times. If set, "
+        "`--database`, `--table` and `--snapshot` are ignored",
+    )
+    clickhouse.add_argument(
+        "--depth",
+        default=1,
+        type=int,
+        help="number of links to follow from the `--focus` tables",
+    )
+    clickhouse.add_argument(
+        "--from-dump",
+        nargs=2,
+        type=FileType("r"),
+        metavar=("TABLES", "COLUMNS"),
+        help="files with JSONEachRow or TSVWithNames dumps of system.tables "
+        "and system.columns. If set, they are used instead of the server",
+    )
+    clickhouse.add_argument(
+        "--snapshot",
+        help="file to keep the schema snapshot. If set, only tables changed "
+        "since the snapshot are queried from the server. For multiple hosts "
+        "the host name is added before the extension",
+    )
+    clickhouse.add_argument(
+        "--columnar",
+        action="store_true",
+        help="receive query results in columnar form, it's faster for big "
+        "amount of columns",
+    )
+    clickhouse.add_argument(
+        "--concurrency",
+        default=4,
+        type=int,
+        help="maximum number of hosts queried concurrently",
+    )
+    clickhouse.add_argument(
+        "--timeout",
+        default=10.0,
+        type=float,
+        help="connect and send/receive timeout for every host, seconds",
+    )
 
     plantuml = parser.add_argument_group("PlantUml parameters")
     plantuml.add_argument(
@@ -123,6 +213,63 @@ def parse_args() -> Namespace:
         default="",
         help="additional parameters to pass into plantuml command",
     )
+    plantuml.add_argument(
+        "--plantuml-workers",
+        default=2,
+        type=int,
+        help="maximum number of diagrams rendered in parallel, each worker "
+        "keeps its own plantuml process",
+    )
+    plantuml.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help="directory to keep rendered diagrams, they are reused for the "
+        "same diagram source, format and plantuml arguments",
+    )
+    plantuml.add_argument(
+        "--cache-size",
+        default=256,
+        type=int,
+        help="maximum size of the rendered diagrams cache, MiB. The least "
+        "recently used diagrams are removed above it",
+    )
+    plantuml.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="do not use the rendered diagrams cache",
+    )
+
+    watch = parser.add_argument_group("watch parameters")
+    watch.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running and regenerate diagrams when the schema is "
+        "changed. The number of tables and the latest metadata modification "
+        "time of every database are polled. Use with `--snapshot` to fetch "
+        "only changed tables",
+    )
+    watch.add_argument(
+        "--interval",
+        default=60.0,
+        type=float,
+        help="seconds between polls of the schema",
+    )
+    watch.add_argument(
+        "--max-backoff",
+        default=600.0,
+        type=float,
+        help="maximum seconds between polls when servers fail, the interval "
+        "is doubled for every consecutive failure",
+    )
+
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const="table",
+        choices=["table", "json"],
+        help="measure phases of the run: queries, parsing, generating and "
+        "rendering, and print the summary into stderr as a table or JSON",
+    )
 
     diagram = parser.add_argument_group("diagram parameters")
     diagram.add_argument(
@@ -132,76 +279,515 @@ def parse_args() -> Namespace:
         default="-",
         help="file to write a generated diagram source",
     )
+    diagram.add_argument(
+        "--split",
+        default=0,
+        type=int,
+        metavar="MAX_TABLES",
+        help="split every diagram into parts of at most MAX_TABLES tables, "
+        "linked tables are kept together. Each part is written to "
+        "`filename_without_extension`.part-N.puml of `--text-output`, or "
+        "part-N.puml if it's stdout, and rendered separately. The Markdown "
+        "index of parts is written to `filename_without_extension`.index.md, "
+        "and `--text-output` includes every part by `!include`. If it's "
+        "stdout, the index is written there",
+    )
     diagram.add_argument(
         "-O",
         "--diagram-output",
-        type=FileType("w"),
         help="file to write a generated diagram. If `--text-output` is set, "
         "the default name is calculated as `filename_without_extension`."
         "`plantuml-format`. If omitted, the default name is sha1 hexdigest "
-        "out of diagram content.",
+        "out of diagram content. For multiple hosts the host name is added "
+        "before the extension.",
     )
 
     args = parser.parse_args()
-    args.databases = args.databases or ["default"]
+    if args.watch and args.from_dump:
+        parser.error("--watch polls servers, it can't be used with --from-dump")
+    if not args.database_patterns:
+        args.databases = args.databases or ["default"]
+    args.patterns = Patterns(
+        args.database_patterns, args.table_patterns, args.exclude
+    )
+    if args.hosts_file is not None:
+        args.hosts.extend(
+            line.strip()
+            for line in args.hosts_file
+            if line.strip() and not line.startswith("#")
+        )
+        args.hosts_file.close()
+    args.hosts = args.hosts or ["localhost"]
     return args
 
 
-def run_plantuml(args: Namespace, diagram: str):
-    diagram_bin = diagram.encode("UTF-8")
-    if args.run_plantuml and args.diagram_output is None:
+def make_client(args: Namespace, host: str) -> Client:
+    hostname, port = split_host(host, args.port)
+    return Client(
+        host=hostname,
+        port=port,
+        user=args.user,
+        password=args.password,
+        connect_timeout=args.timeout,
+        send_receive_timeout=args.timeout,
+    )
+
+
+def get_tables(
+    args: Namespace, host: str, client: Optional[Client] = None
+) -> Tables:
+    """
+    Gets tables of the host. If the client is not passed, the new one is
+    created and disconnected afterwards
+    """
+    own_client = client is None
+    if client is None:
+        client = make_client(args, host)
+    snapshot = args.snapshot
+    if snapshot is not None and len(args.hosts) > 1:
+        snapshot = "{1}.{0}{2}".format(host, *splitext(snapshot))
+    try:
+        with profiler.span("load tables"):
+            return Tables(
+                ClickHouseSource(client, args.columnar),
+                args.databases,
+                args.tables,
+                snapshot,
+                args.focus,
+                args.depth,
+                args.patterns,
+            )
+    finally:
+        if own_client:
+            client.disconnect()
+
+
+def collect_tables(args: Namespace) -> Dict[str, Tables]:
+    """
+    Gets tables from all hosts concurrently, one client per host. Hosts that
+    failed are logged and skipped.
+    """
+    if args.from_dump:
+        tables_dump, columns_dump = args.from_dump
+        with tables_dump, columns_dump:
+            source = DumpSource(tables_dump, columns_dump)
+        with profiler.span("load tables"):
+            tables = Tables(
+                source,
+                args.databases,
+                args.tables,
+                focus=args.focus,
+                depth=args.depth,
+                patterns=args.patterns,
+            )
+        return OrderedDict([("dump", tables)])
+
+    results = OrderedDict(
+        (h, None) for h in args.hosts
+    )  # type: Dict[str, Optional[Tables]]
+    with ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as executor:
+        futures = {executor.submit(get_tables, args, h): h for h in results}
+        for future in as_completed(futures):
+            host = futures[future]
+            try:
+                results[host] = future.result()
+            except Exception as e:
+                logger.error("Failed to get tables from {}: {}".format(host, e))
+
+    return OrderedDict((h, t) for h, t in results.items() if t is not None)
+
+
+def diagram_output_name(
+    args: Namespace, diagram: str, name: Optional[str] = None
+) -> str:
+    """
+    Returns the file name to write the rendered diagram. If the `name` is
+    set, e.g. the host, it's added to the file name
+    """
+    suffix = "" if name is None else "." + name
+    diagram_output = args.diagram_output
+    if diagram_output is None:
         if args.text_output == sys.stdout:
-            file_name = sha1(diagram_bin).hexdigest()
-            args.diagram_output = "{}.{}".format(
-                file_name, args.plantuml_format
+            file_name = sha1(diagram.encode("UTF-8")).hexdigest()
+            return "{}.{}".format(file_name, args.plantuml_format)
+        return "{}{}.{}".format(
+            splitext(args.text_output.name)[0], suffix, args.plantuml_format
+        )
+    elif suffix:
+        return "{1}{0}{2}".format(suffix, *splitext(diagram_output))
+    return diagram_output
+
+
+def part_output_name(args: Namespace, name: str) -> str:
+    """
+    Returns the file name to write the source of the diagram's part
+    """
+    if args.text_output == sys.stdout:
+        return "{}.puml".format(name)
+    return "{}.{}.puml".format(splitext(args.text_output.name)[0], name)
+
+
+def index_output_name(args: Namespace) -> Optional[str]:
+    """
+    Returns the file name to write the index of the diagram's parts, or None
+    if it goes to stdout together with the text output
+    """
+    if args.text_output == sys.stdout:
+        return None
+    return "{}.index.md".format(splitext(args.text_output.name)[0])
+
+
+def write_index(output: TextIO, parts: List[Tuple[str, str, str, Tables]]):
+    """
+    Writes the Markdown index of the diagram's parts. Parts are tuples of
+    the name, the source file, the rendered file or empty string, and the
+    tables
+    """
+    output.write("# ClickHouse tables\n")
+    for name, source, image, tables in parts:
+        output.write("\n## {}\n\n".format(name))
+        output.write("Source: [{0}]({0})\n\n".format(source))
+        if image:
+            output.write("![{0}]({0})\n\n".format(image))
+        output.write("".join("- `{}`\n".format(t) for t in tables))
+
+
+def run_plantuml(
+    args: Namespace,
+    renderer: RenderPool,
+    cache: Optional[RenderCache],
+    diagram: str,
+    diagram_output: str,
+) -> Optional[Tuple[str, str, Future]]:
+    """
+    Schedules the diagram rendering. Returns the file name to write the
+    diagram, the cache key and the future with the rendered diagram, or None
+    if the rendering is not needed
+    """
+    if (
+        args.diagram_output is None
+        and args.text_output == sys.stdout
+        and isfile(diagram_output)
+    ):
+        # The name is the digest of the diagram, the file is up to date
+        logger.info(
+            "File {} exists, do not run plantuml".format(diagram_output)
+        )
+        return None
+
+    key = RenderCache.key(
+        diagram, args.plantuml_format, args.plantuml_arguments.split()
+    )
+    if cache is not None and cache.get(key) is not None:
+        logger.info("File {} is taken from the cache".format(diagram_output))
+        cache.copy(key, diagram_output)
+        return None
+
+    logger.info("Generating file {}".format(diagram_output))
+    return (
+        diagram_output,
+        key,
+        renderer.submit(diagram, args.plantuml_format),
+    )
+
+
+def make_cache(args: Namespace) -> Optional[RenderCache]:
+    if not args.run_plantuml or args.no_cache:
+        return None
+    return RenderCache(args.cache_dir, args.cache_size << 20)
+
+
+def generate(
+    args: Namespace,
+    hosts_tables: Dict[str, Tables],
+    memo: TableMemo,
+    renderer: Optional[RenderPool] = None,
+    cache: Optional[RenderCache] = None,
+):
+    """
+    Writes diagrams of the hosts, or their parts if `--split` is set, and
+    renders them if the renderer is passed
+    """
+    multihost = len(args.hosts) > 1
+    diagrams = []  # type: List[Tuple[Optional[str], Tables]]
+    for host, tables in hosts_tables.items():
+        name = host if multihost else None
+        if not args.split:
+            diagrams.append((name, tables))
+            continue
+        parts = split_tables(tables, args.split)
+        logger.info("Diagram is split into %s parts", len(parts))
+        for i, part in enumerate(parts, 1):
+            part_name = "part-{}".format(i)
+            if name is not None:
+                part_name = "{}.{}".format(name, part_name)
+            diagrams.append((part_name, part))
+
+    # Diagrams of all hosts are written one after another into the text
+    # output, PlantUML handles multiple @startuml blocks in one file
+    if renderer is None and not args.split:
+        # Nothing else needs the diagrams, so they are streamed to the output
+        for _, tables in diagrams:
+            with profiler.span("plantuml") as span:
+                span.rows = len(tables)
+                write_plantuml_tables(tables, args.text_output, memo)
+        args.text_output.flush()
+        return
+
+    renders = []
+    index = []
+    for name, tables in diagrams:
+        with profiler.span("plantuml") as span:
+            span.rows = len(tables)
+            diagram = plantuml_tables(tables, memo)
+        if args.split:
+            source = part_output_name(args, name)
+            with open(source, "w") as out:
+                out.write(diagram)
+        else:
+            args.text_output.write(diagram)
+
+        diagram_output = ""
+        if renderer is not None:
+            diagram_output = diagram_output_name(args, diagram, name)
+            # Parts are rendered in parallel by the pool
+            render = run_plantuml(
+                args, renderer, cache, diagram, diagram_output
             )
-            if isfile(args.diagram_output):
-                logger.info(
-                    "File {} exists, do not run plantuml".format(
-                        args.diagram_output
-                    )
-                )
-                return
+            if render is not None:
+                renders.append(render)
+        if args.split:
+            index.append((name, source, diagram_output, tables))
+    if args.split:
+        index_output = index_output_name(args)
+        if index_output is None:
+            write_index(args.text_output, index)
         else:
-            args.diagram_output = "{}.{}".format(
-                splitext(args.text_output.name)[0],
-                args.plantuml_format,
+            # Links are relative to the index file
+            directory = dirname(index_output) or curdir
+            index = [
+                (
+                    name,
+                    relpath(source, directory),
+                    image and relpath(image, directory),
+                    tables,
+                )
+                for name, source, image, tables in index
+            ]
+            with open(index_output, "w") as out:
+                write_index(out, index)
+            # The text output includes every part as a separate diagram
+            args.text_output.write(
+                "".join(
+                    "@startuml\n!include {}\n@enduml\n".format(source)
+                    for _, source, _, _ in index
+                )
             )
-    logger.info("Generating file {}".format(args.diagram_output))
-    command = ["plantuml", "-p", "-t" + args.plantuml_format]
-    command.extend(args.plantuml_arguments.split())
-    proc = Popen(command, stdout=PIPE, stdin=PIPE)
-    if proc.stdin is not None:
-        proc.stdin.write(diagram_bin)
-    with open(args.diagram_output, "bw") as out:
-        out.write(proc.communicate()[0])
+    args.text_output.flush()
+
+    for diagram_output, key, future in renders:
+        if cache is None:
+            write_file(diagram_output, future.result())
+            continue
+        cache.put(key, future.result())
+        cache.copy(key, diagram_output)
+
+
+class Watcher(object):
+    """
+    Regenerates diagrams when the schema fingerprint of any host is changed,
+    see :meth:`Source.get_fingerprint`. Connections are kept open between
+    polls. Unchanged tables and diagrams are taken from the memo and the
+    render cache, and with `--snapshot` only changed tables are fetched
+    """
+
+    def __init__(
+        self,
+        args: Namespace,
+        renderer: Optional[RenderPool] = None,
+        cache: Optional[RenderCache] = None,
+    ):
+        self.args = args
+        self.renderer = renderer
+        self.cache = cache
+        self.clients = OrderedDict(
+            (h, make_client(args, h)) for h in args.hosts
+        )  # type: Dict[str, Client]
+        # Databases to fingerprint by host. With `--focus` they are the
+        # databases of the loaded tables, so changes of neighbours are seen
+        self.databases = {}  # type: Dict[str, List[str]]
+        self.focus_databases = {f.split(".", 1)[0] for f in args.focus or ()}
+        self.fingerprints = {}  # type: Dict[str, Dict[str, Tuple[int, int]]]
+        self.hosts_tables = {}  # type: Dict[str, Tables]
+        self.memo = TableMemo()
+        self.failures = 0
+
+    def _databases(self, host: str) -> List[str]:
+        return self.databases.get(host) or sorted(self.focus_databases)
+
+    def _fingerprint(
+        self, host: str, source: ClickHouseSource
+    ) -> Dict[str, Tuple[int, int]]:
+        if self.args.focus:
+            # Focus ignores `--tables` and patterns
+            return source.get_fingerprint(self._databases(host))
+        return source.get_fingerprint(
+            self.args.databases, self.args.tables, self.args.patterns
+        )
+
+    def poll(self) -> bool:
+        """
+        Checks all hosts once and regenerates diagrams if any is changed.
+        Returns True if diagrams are regenerated
+        """
+        changed = False
+        failed = False
+        for host, client in self.clients.items():
+            try:
+                source = ClickHouseSource(client)
+                fingerprint = self._fingerprint(host, source)
+                previous = self.fingerprints.get(host, {})
+                if host in self.fingerprints and fingerprint == previous:
+                    continue
+                logger.info(
+                    "Databases of %s are changed: %s",
+                    host,
+                    ", ".join(
+                        sorted(
+                            d
+                            for d in set(fingerprint) | set(previous)
+                            if fingerprint.get(d) != previous.get(d)
+                        )
+                    ),
+                )
+                tables = get_tables(self.args, host, client)
+                self.hosts_tables[host] = tables
+                if self.args.focus:
+                    databases = self.focus_databases.union(
+                        t.database for t in tables
+                    )
+                    if databases != set(self._databases(host)):
+                        self.databases[host] = sorted(databases)
+                        fingerprint = self._fingerprint(host, source)
+                self.fingerprints[host] = fingerprint
+                changed = True
+            except Exception as e:
+                failed = True
+                logger.error("Failed to get tables from %s: %s", host, e)
+
+        self.failures = self.failures + 1 if failed else 0
+        if not changed:
+            return False
+
+        hosts_tables = OrderedDict(
+            (h, self.hosts_tables[h])
+            for h in self.clients
+            if self.hosts_tables.get(h)
+        )
+        if not hosts_tables:
+            logger.warning("There are no tables with given parameters")
+            return False
+        output = self.args.text_output
+        if output != sys.stdout:
+            output.seek(0)
+            output.truncate()
+        generate(self.args, hosts_tables, self.memo, self.renderer, self.cache)
+        return True
+
+    def delay(self) -> float:
+        """
+        Returns the interval before the next poll, it's doubled for every
+        consecutive failure up to `--max-backoff`
+        """
+        if not self.failures:
+            return self.args.interval
+        # The exponent is clamped, the float overflows after ~1024 failures
+        backoff = self.args.interval * 2 ** min(self.failures, 32)
+        return min(backoff, self.args.max_backoff)
+
+    def run(self):
+        while True:
+            self.poll()
+            sleep(self.delay())
+
+    def close(self):
+        for client in self.clients.values():
+            client.disconnect()
+
+
+def watch(args: Namespace):
+    renderer = None
+    if args.run_plantuml:
+        renderer = RenderPool(
+            args.plantuml_workers, args.plantuml_arguments.split()
+        )
+    watcher = Watcher(args, renderer, make_cache(args))
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        logger.info("Watching is stopped")
+    finally:
+        watcher.close()
+        if renderer is not None:
+            renderer.close()
+        if args.text_output != sys.stdout:
+            args.text_output.close()
 
 
 def main():
+    if sys.argv[1:2] == ["serve"]:
+        serve(sys.argv[2:])
+        return
     args = parse_args()
     log_levels = [logging.CRITICAL, logging.WARN, logging.INFO, logging.DEBUG]
     logger.setLevel(log_levels[min(args.verbose, 3)])
-    logger.debug("Arguments are {}".format(pformat(args.__dict__)))
-    client = Client(
-        host=args.host, port=args.port, user=args.user, password=args.password
-    )
-    tables = Tables(client, args.databases, args.tables)
-    logger.debug("Tables are: {}".format(pformat(list(map(str, tables)))))
-    if not tables:
+    profiler.enabled = args.profile is not None
+    try:
+        run(args)
+    finally:
+        if args.profile is not None:
+            sys.stderr.write(profiler.report(args.profile))
+
+
+def run(args: Namespace):
+    # pformat of thousands of tables is expensive, so debug messages are
+    # built only when they are going to be emitted
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("Arguments are %s", pformat(args.__dict__))
+    if args.watch:
+        watch(args)
+        return
+    hosts_tables = collect_tables(args)
+    for host, tables in list(hosts_tables.items()):
+        if debug:
+            logger.debug(
+                "Tables of %s are: %s", host, pformat(list(map(str, tables)))
+            )
+        if not tables:
+            del hosts_tables[host]
+    if not hosts_tables:
         logger.critical("There are no tables with given parameters")
         sys.exit(2)
-    logger.debug(
-        "Columns of the first table are {}".format(
-            pformat([c.__dict__ for c in tables[0].columns])
+    if debug:
+        first_table = next(iter(hosts_tables.values()))[0]
+        logger.debug(
+            "Columns of the first table are %s",
+            pformat([c.as_dict() for c in first_table.columns]),
         )
-    )
-    diagram = plantuml_tables(tables)
-    args.text_output.write(diagram)
-    if args.text_output != sys.stdout:
-        args.text_output.close()
-
-    if args.run_plantuml:
-        run_plantuml(args, diagram)
+    # Hosts usually share most of the schema, so tables' blocks are reused
+    memo = TableMemo()
+    try:
+        if not args.run_plantuml:
+            generate(args, hosts_tables, memo)
+            return
+        with RenderPool(
+            args.plantuml_workers, args.plantuml_arguments.split()
+        ) as renderer:
+            generate(args, hosts_tables, memo, renderer, make_cache(args))
+    finally:
+        if args.text_output != sys.stdout:
+            args.text_output.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+# License: Apache-2.0
+# Copyright (C) 2020 Mikhail f. Shiryaev
+
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from . import Client, ClientPool
+from .sources import ClickHouseSource, Patterns
+from .tables import Tables
+
+logger = logging.getLogger("clickhouse-plantuml")
+
+ClientFactory = Callable[[], Client]
+
+
+class AsyncTables(object):
+    """
+    Loads :class:`Tables` with asyncio. The driver is blocking, so every query
+    runs in the executor with its own client from `client_factory`. Tables and
+    columns are queried concurrently, one pair of queries per database
+
+    Parameters
+    ----------
+    client_factory : `Union[Callable[[], Client], ClientPool]`
+        returns a new client, e.g. `functools.partial(Client, "localhost")`.
+        If it's a pool, clients are checked out of it and kept connected
+    executor : `Executor`
+        the executor to run queries, the loop's default one if omitted
+    columnar : `bool`
+        see :class:`ClickHouseSource`
+    """
+
+    def __init__(
+        self,
+        client_factory: Union[ClientFactory, ClientPool],
+        executor: Optional[Executor] = None,
+        columnar: bool = False,
+    ):
+        self.client_factory = client_factory
+        self.executor = executor
+        self.columnar = columnar
+
+    def _query(self, method: Callable[[ClickHouseSource], Any]) -> Any:
+        if isinstance(self.client_factory, ClientPool):
+            return method(ClickHouseSource(self.client_factory, self.columnar))
+        client = self.client_factory()
+        try:
+            return method(ClickHouseSource(client, self.columnar))
+        finally:
+            client.disconnect()
+
+    async def _run(self, method: Callable[[ClickHouseSource], Any]) -> Any:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, self._query, method)
+
+    async def load(
+        self,
+        databases: List[str] = None,
+        tables: List[str] = None,
+        patterns: Patterns = None,
+    ) -> Tables:
+        """
+        Returns tables the same as :class:`Tables` with the same arguments
+        """
+        result = Tables(None)
+        databases = list(databases or [])
+        if not databases and not patterns:
+            return result
+
+        # Without databases patterns select from all of them in one query
+        selections = [[d] for d in databases] or [[]]
+        queries = [
+            self._run(lambda s, ds=ds: list(s.get_tables(ds, tables, patterns)))
+            for ds in selections
+        ] + [
+            self._run(
+                lambda s, ds=ds: list(s.get_columns_of(ds, tables, patterns))
+            )
+            for ds in selections
+        ]
+        results = await asyncio.gather(*queries)
+        for rows in results[: len(selections)]:
+            result._build_tables(rows)
+
+        if any(t.engine == "Merge" for t in result):
+            await self._run(
+                lambda s: self._resolve_merges(
+                    result,
+                    s,
+                    set() if tables or patterns else set(databases),
+                )
+            )
+
+        # Tables created between queries do not have a place for columns
+        result._add_columns(
+            c
+            for rows in results[len(selections) :]
+            for c in rows
+            if "{}.{}".format(c[0], c[1]) in result.as_dict
+        )
+        result._merge_matviews()
+        return result
+
+    @staticmethod
+    def _resolve_merges(result: Tables, source: ClickHouseSource, loaded):
+        source, result.source = result.source, source
+        try:
+            result._resolve_merges(loaded)
+        finally:
+            result.source = source
+
+
+async def load_hosts(
+    client_factories: Dict[str, Union[ClientFactory, ClientPool]],
+    databases: List[str] = None,
+    tables: List[str] = None,
+    patterns: Patterns = None,
+    executor: Optional[Executor] = None,
+    columnar: bool = False,
+) -> Dict[str, Tables]:
+    """
+    Loads tables of all hosts concurrently, see :meth:`AsyncTables.load`.
+    Hosts that failed are logged and skipped, the order of hosts is kept
+    """
+    hosts = list(client_factories)
+    results = await asyncio.gather(
+        *(
+            AsyncTables(client_factories[h], executor, columnar).load(
+                databases, tables, patterns
+            )
+            for h in hosts
+        ),
+        return_exceptions=True
+    )
+    loaded = OrderedDict()  # type: Dict[str, Tables]
+    for host, result in zip(hosts, results):
+        if isinstance(result, Exception):
+            logger.error(
+                "Failed to get tables from {}: {}".format(host, result)
+            )
+            continue
+        loaded[host] = result
+    return loaded
@@ -3,26 +3,291 @@
 # License: Apache-2.0
 # Copyright (C) 2020 Mikhail f. Shiryaev
 
+import threading
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from functools import partial
+from inspect import signature
+from itertools import chain
+from time import monotonic
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
 from clickhouse_driver import Client as OriginalClient  # type: ignore
+from clickhouse_driver.errors import NetworkError, SocketTimeoutError
+
+RowFactory = Callable[[List[str]], Optional[Callable[[Sequence[Any]], Any]]]
+
+
+def dict_row(names: List[str]) -> Callable[[Sequence[Any]], Any]:
+    """
+    Row factory returning rows as dictionaries
+    """
+    return lambda row: dict(zip(names, row))
+
+
+def tuple_row(names: List[str]) -> None:
+    """
+    Row factory returning rows as is, positional tuples
+    """
+    return None
+
+
+def namedtuple_row(names: List[str]) -> Callable[[Sequence[Any]], Any]:
+    """
+    Row factory returning rows as named tuples
+    """
+    return namedtuple("Row", names, rename=True)._make  # type: ignore
+
+
+def constructor_row(constructor: Callable) -> RowFactory:
+    """
+    Returns row factory creating objects with the constructor, e.g. `Column`.
+    If columns are the leading parameters of the constructor, the row is
+    passed as positional arguments, otherwise as keyword ones
+    """
+    parameters = list(signature(constructor).parameters)
+
+    def factory(names: List[str]) -> Callable[[Sequence[Any]], Any]:
+        if parameters[: len(names)] == names:
+            return lambda row: constructor(*row)
+        return lambda row: constructor(**dict(zip(names, row)))
+
+    return factory
 
 
 class Client(OriginalClient):
     """
-    Wrapper for clickhouse_driver.Client with execute_dict method
+    Wrapper for clickhouse_driver.Client with execute_dict method and row
+    factories. The row factory is called once per query with the columns
+    names and returns the function to convert every row, or None to return
+    rows as is. See :func:`dict_row`, :func:`tuple_row`,
+    :func:`namedtuple_row` and :func:`constructor_row`
     """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-    def execute_dict(self, *args, **kwargs):
+    def execute_rows(
+        self, *args, row_factory: RowFactory = dict_row, **kwargs
+    ) -> List[Any]:
         kwargs["with_column_types"] = True
         rows, columns = self.execute(*args, **kwargs)
-        result = [{columns[i][0]: v for i, v in enumerate(r)} for r in rows]
-        return result
+        make_row = row_factory([c[0] for c in columns])
+        if make_row is None:
+            return rows
+        return [make_row(r) for r in rows]
 
-    def execute_iter_dict(self, *args, **kwargs):
+    def execute_iter_rows(
+        self, *args, row_factory: RowFactory = dict_row, **kwargs
+    ) -> Iterator[Any]:
         kwargs["with_column_types"] = True
         rows = self.execute_iter(*args, **kwargs)
         columns = next(rows)
-        for r in rows:
-            yield {columns[i][0]: v for i, v in enumerate(r)}
+        make_row = row_factory([c[0] for c in columns])
+        if make_row is None:
+            yield from rows
+        else:
+            yield from map(make_row, rows)
+
+    def execute_columnar(
+        self, *args, **kwargs
+    ) -> Tuple[List[Sequence[Any]], List[str]]:
+        """
+        Executes the query in columnar mode, blocks are not transposed into
+        rows. Returns the list of columns data and the columns names
+        """
+        kwargs["with_column_types"] = True
+        kwargs["columnar"] = True
+        data, columns = self.execute(*args, **kwargs)
+        return data, [c[0] for c in columns]
+
+    def execute_dict(self, *args, **kwargs):
+        return self.execute_rows(*args, row_factory=dict_row, **kwargs)
+
+    def execute_iter_dict(self, *args, **kwargs):
+        return self.execute_iter_rows(*args, row_factory=dict_row, **kwargs)
+
+
+# Errors of broken connections, queries are retried on them once
+CONNECTION_ERRORS = (NetworkError, SocketTimeoutError, EOFError, OSError)
+
+
+def _started(rows: Iterator[Any]) -> Iterator[Any]:
+    """
+    Starts the lazy query by taking the first row, so errors of sending the
+    query are raised here
+    """
+    for row in rows:
+        return chain((row,), rows)
+    return iter(())
+
+
+class ClientPool(object):
+    """
+    Bounded pool of :class:`Client`, it's safe to share between threads. It
+    has the same `execute_*` methods as the client, each of them checks out
+    a client for the query, so the pool could be passed everywhere the
+    client is accepted, e.g. into :class:`Tables` or :class:`AsyncTables`.
+
+    Clients are created on demand up to `size`, the idle ones are reused.
+    A client idle longer than `max_idle` is disconnected on checkout instead
+    of reusing the probably stale connection, the driver pings the others
+    before every query. A client that failed a query is disconnected, so it
+    reconnects on the next one, and queries failed on a broken connection
+    are retried once before any row is returned.
+
+    Parameters
+    ----------
+    *args, **kwargs
+        arguments of :class:`Client`
+    size : `int`
+        maximum number of clients
+    max_idle : `float`
+        seconds after which an idle client is reconnected
+    timeout : `Optional[float]`
+        seconds to wait for a free client, forever if None
+
+    Attributes
+    ----------
+    factory : `Callable[[], Client]`
+        creates new clients of the pool
+    last_query : `Optional[QueryInfo]`
+        the info of the last query made in the current thread
+    """
+
+    def __init__(
+        self,
+        *args,
+        size: int = 4,
+        max_idle: float = 60.0,
+        timeout: Optional[float] = None,
+        **kwargs
+    ):
+        self.factory = partial(
+            Client, *args, **kwargs
+        )  # type: Callable[[], Client]
+        self.size = size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._semaphore = threading.BoundedSemaphore(max(size, 1))
+        self._lock = threading.Lock()
+        # Idle clients with the time they were returned, the last is the
+        # most recently used
+        self._idle = deque()  # type: deque
+        self._local = threading.local()
+
+    @contextmanager
+    def connection(self) -> Iterator[Client]:
+        """
+        Checks out a client, it's returned into the pool on exit. If the
+        block is failed or interrupted, the client is disconnected
+        """
+        client = self._acquire()
+        try:
+            yield client
+        except BaseException:
+            # The connection could be in the middle of a query
+            client.disconnect()
+            raise
+        finally:
+            self._local.last_query = getattr(client, "last_query", None)
+            self._release(client)
+
+    @property
+    def last_query(self):
+        return getattr(self._local, "last_query", None)
+
+    def execute(self, *args, **kwargs):
+        return self._execute(lambda c: c.execute(*args, **kwargs))
+
+    def execute_rows(self, *args, **kwargs) -> List[Any]:
+        return self._execute(lambda c: c.execute_rows(*args, **kwargs))
+
+    def execute_columnar(
+        self, *args, **kwargs
+    ) -> Tuple[List[Sequence[Any]], List[str]]:
+        return self._execute(lambda c: c.execute_columnar(*args, **kwargs))
+
+    def execute_dict(self, *args, **kwargs):
+        return self._execute(lambda c: c.execute_dict(*args, **kwargs))
+
+    def execute_iter_rows(self, *args, **kwargs) -> Iterator[Any]:
+        """
+        Streams rows the same as :meth:`Client.execute_iter_rows`, the client
+        is checked out until the rows are exhausted or the iterator is closed
+        """
+        return self._iter(lambda c: c.execute_iter_rows(*args, **kwargs))
+
+    def execute_iter_dict(self, *args, **kwargs) -> Iterator[Any]:
+        return self._iter(lambda c: c.execute_iter_dict(*args, **kwargs))
+
+    def disconnect(self):
+        """
+        Disconnects idle clients, the pool could be used afterwards
+        """
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for client, _ in idle:
+            client.disconnect()
+
+    def _acquire(self) -> Client:
+        if not self._semaphore.acquire(timeout=self.timeout):
+            raise TimeoutError(
+                "No free client in the pool of {}".format(self.size)
+            )
+        try:
+            with self._lock:
+                if not self._idle:
+                    return self.factory()
+                client, released = self._idle.pop()
+            if monotonic() - released > self.max_idle:
+                client.disconnect()
+            return client
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    def _release(self, client: Client):
+        with self._lock:
+            self._idle.append((client, monotonic()))
+        self._semaphore.release()
+
+    @staticmethod
+    def _retry(client: Client, query: Callable[[Client], Any]) -> Any:
+        try:
+            return query(client)
+        except CONNECTION_ERRORS:
+            client.disconnect()
+            return query(client)
+
+    def _execute(self, query: Callable[[Client], Any]) -> Any:
+        with self.connection() as client:
+            return self._retry(client, query)
+
+    def _iter(self, query: Callable[[Client], Iterator[Any]]) -> Iterator[Any]:
+        with self.connection() as client:
+            yield from self._retry(client, lambda c: _started(query(c)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.disconnect()
+
+
+def split_host(host: str, default_port: int) -> Tuple[str, int]:
+    """
+    Splits `host:port` string, returns `default_port` if it's omitted
+    """
+    hostname, _, port = host.rpartition(":")
+    if hostname and port.isdigit():
+        return hostname, int(port)
+    return host, default_port
@@ -3,12 +3,31 @@
 # License: Apache-2.0
 # Copyright (C) 2020 Mikhail f. Shiryaev
 
+from typing import Any, Dict
+
 
 class Column(object):
     """
-    Represents ClickHouse column
+    Represents ClickHouse column. The arguments order is the same as the
+    columns order of the **system.columns** rows, so a row tuple could be
+    passed as `Column(*row)`
     """
 
+    __slots__ = (
+        "database",
+        "table",
+        "name",
+        "type",
+        "default_kind",
+        "default_expression",
+        "comment",
+        "compression_codec",
+        "is_in_partition_key",
+        "is_in_sorting_key",
+        "is_in_primary_key",
+        "is_in_sampling_key",
+    )
+
     def __init__(
         self,
         database: str,
@@ -37,6 +56,24 @@ class Column(object):
         self.is_in_primary_key = is_in_primary_key
         self.is_in_sampling_key = is_in_sampling_key
 
+    def __getattr__(self, name: str):
+        # Subclasses without __slots__ have an instance dictionary, but the
+        # slots shadow attributes written there directly
+        try:
+            return object.__getattribute__(self, "__dict__")[name]
+        except (AttributeError, KeyError):
+            raise AttributeError(
+                "{!r} object has no attribute {!r}".format(
+                    type(self).__name__, name
+                )
+            ) from None
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Returns the attributes as a dictionary, there is no instance one
+        """
+        return {a: getattr(self, a) for a in self.__slots__}
+
     @property
     def db_table(self):
         return "{}.{}".format(self.database, self.table)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+# License: Apache-2.0
+# Copyright (C) 2020 Mikhail f. Shiryaev
+
+from collections import OrderedDict
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Tuple
+from . import Table
+from .tables import Tables
+
+Edge = Tuple[str, str]
+
+
+class DependencyGraph(object):
+    """
+    Unique dependency edges between tables. The edge `(source, target)`
+    means `source -|> target`: a table depends on every one of
+    :attr:`Table.dependencies`, and every one of
+    :attr:`Table.rev_dependencies` depends on the table. Edges to tables out
+    of the graph are skipped, and the same link recorded on both ends is kept
+    once. Edges are ordered by the first occurrence
+
+    Parameters
+    ----------
+    tables : `Iterable[Table]`
+        tables to build the graph of, usually :class:`Tables`
+
+    Attributes
+    ----------
+    nodes : `Dict[str, Table]`
+        tables of the graph by name
+    successors : `Dict[str, List[str]]`
+        tables each table depends on
+    predecessors : `Dict[str, List[str]]`
+        tables depending on each table
+    """
+
+    def __init__(self, tables: Iterable[Table] = ()):
+        self.nodes = OrderedDict()  # type: Dict[str, Table]
+        self.edges = OrderedDict()  # type: Dict[Edge, None]
+        self.successors = {}  # type: Dict[str, List[str]]
+        self.predecessors = {}  # type: Dict[str, List[str]]
+        self.add_tables(tables)
+
+    def add_tables(self, tables: Iterable[Table]):
+        """
+        Adds tables and edges between all tables of the graph
+        """
+        tables = list(tables)
+        for t in tables:
+            self.nodes[str(t)] = t
+
+        for t in tables:
+            name = str(t)
+            for d in t.dependencies:
+                if d in self.nodes:
+                    self.add_edge(name, d)
+
+            for r in t.rev_dependencies:
+                if r in self.nodes:
+                    self.add_edge(r, name)
+
+    def add_edge(self, source: str, target: str) -> bool:
+        """
+        Adds the edge if it is new. Returns True if the edge was added
+        """
+        edge = (source, target)
+        if edge in self.edges:
+            return False
+        self.edges[edge] = None
+        self.successors.setdefault(source, []).append(target)
+        self.predecessors.setdefault(target, []).append(source)
+        return True
+
+    def components(self) -> List[List[str]]:
+        """
+        Returns connected components of the graph regardless of edges'
+        direction. Components are ordered by their first table, tables in a
+        component are in breadth-first order, so linked tables are close
+        """
+        seen = set()
+        components = []
+        for name in self.nodes:
+            if name in seen:
+                continue
+            seen.add(name)
+            component = [name]
+            # The component grows while it's iterated
+            for node in component:
+                for n in chain(
+                    self.successors.get(node, ()),
+                    self.predecessors.get(node, ()),
+                ):
+                    if n not in seen:
+                        seen.add(n)
+                        component.append(n)
+            components.append(component)
+        return components
+
+    def split(self, max_size: int) -> List[List[str]]:
+        """
+        Splits tables into parts of at most `max_size` tables. Components are
+        never split if they fit, and they are packed together first fit
+        decreasing. Bigger components are cut in breadth-first order into
+        chunks, so only edges between the chunks are lost. Parts are ordered
+        by their first table, tables in a part are in the graph's order
+        """
+        if max_size <= 0:
+            return [list(self.nodes)]
+
+        chunks = []
+        for component in self.components():
+            for i in range(0, len(component), max_size):
+                chunks.append(component[i : i + max_size])
+
+        parts = []  # type: List[List[str]]
+        # Full parts are not checked anymore
+        free = []  # type: List[List[str]]
+        for chunk in sorted(chunks, key=len, reverse=True):
+            for part in free:
+                if len(part) + len(chunk) <= max_size:
+                    part.extend(chunk)
+                    break
+            else:
+                part = list(chunk)
+                parts.append(part)
+                free.append(part)
+            if len(part) == max_size:
+                free.remove(part)
+
+        order = {name: i for i, name in enumerate(self.nodes)}
+        for part in parts:
+            part.sort(key=order.__getitem__)
+        parts.sort(key=lambda p: order[p[0]])
+        return parts
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __iter__(self) -> Iterator[Edge]:
+        return iter(self.edges)
+
+    def __contains__(self, edge: Edge):
+        return edge in self.edges
+
+
+def split_tables(tables: Iterable[Table], max_size: int) -> List[Tables]:
+    """
+    Splits tables into parts of at most `max_size` tables keeping linked
+    tables together, see :meth:`DependencyGraph.split`
+    """
+    graph = DependencyGraph(tables)
+    parts = []
+    for names in graph.split(max_size):
+        part = Tables(None)
+        part.extend(graph.nodes[n] for n in names)
+        parts.append(part)
+    return parts
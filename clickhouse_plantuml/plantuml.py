@@ -3,12 +3,123 @@
 # License: Apache-2.0
 # Copyright (C) 2020 Mikhail f. Shiryaev
 
-from . import Column, Table, Tables
-from typing import List
+from . import Column, DependencyGraph, Table, Tables
+from collections import OrderedDict
+from typing import Hashable, Iterator, Optional, Sequence, TextIO
+
+MACROS = {
+    "MaterializedView": "MaterializedView",
+    "View": "View",
+    "Distributed": "Distributed",
+}
+
+KEY_SIGNS = {
+    "partition": "<size:15><&list-rich></size>",
+    "sorting": "<size:15><&signal></size>",
+    "primary": "<size:15><&key></size>",
+    "sampling": "<size:15><&collapse-down></size>",
+}
+# Names of the keys' attributes in Table and Column, and the columns' suffixes
+TABLE_KEY_ATTRS = {k: "{}_key".format(k) for k in KEY_SIGNS}
+COLUMN_KEY_ATTRS = {k: "is_in_{}_key".format(k) for k in KEY_SIGNS}
+COLUMN_KEY_SUFFIXES = {k: " " + s for k, s in KEY_SIGNS.items()}
+KEY_HEADERS = {k: "..{}{} key..\n".format(s, k) for k, s in KEY_SIGNS.items()}
+
+TABLE_KEYS = ("partition", "sorting", "sampling")
+TABLE_KEYS_WITH_PRIMARY = ("partition", "sorting", "primary", "sampling")
+
+
+class TableMemo(object):
+    """
+    LRU cache of rendered tables' blocks. The block is reused while the
+    table's schema, see :meth:`fingerprint`, is the same. Sharing the memo
+    between diagrams of the same or similar catalogs renders only changed
+    tables
+
+    Parameters
+    ----------
+    max_size : `int`
+        maximum number of blocks to keep
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self.blocks = OrderedDict()  # type: OrderedDict
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(table: Table) -> Hashable:
+        """
+        Returns everything the table's block depends on
+        """
+        t = table
+        return (
+            str(t),
+            t.engine,
+            tuple(t.engine_config),
+            tuple(t.replication_config),
+            t.partition_key,
+            t.sorting_key,
+            t.primary_key,
+            t.sampling_key,
+            tuple(
+                (
+                    c.name,
+                    c.type,
+                    c.is_in_partition_key,
+                    c.is_in_sorting_key,
+                    c.is_in_primary_key,
+                    c.is_in_sampling_key,
+                )
+                for c in t.columns
+            ),
+        )
+
+    def render(self, table: Table) -> str:
+        key = self.fingerprint(table)
+        block = self.blocks.get(key)
+        if block is not None:
+            self.hits += 1
+            self.blocks.move_to_end(key)
+            return block
+
+        self.misses += 1
+        block = gen_table(table)
+        self.blocks[key] = block
+        if len(self.blocks) > self.max_size:
+            self.blocks.popitem(last=False)
+        return block
+
+    def __len__(self):
+        return len(self.blocks)
+
 
+def plantuml_tables(tables: Tables, memo: Optional[TableMemo] = None) -> str:
+    return "".join(iter_plantuml_tables(tables, memo))
 
-def plantuml_tables(tables: Tables):
-    return plantuml_header() + gen_tables(tables) + plantuml_footer()
+
+def iter_plantuml_tables(
+    tables: Tables, memo: Optional[TableMemo] = None
+) -> Iterator[str]:
+    """
+    Yields the PlantUML source code chunk by chunk: the header, one chunk per
+    table, the dependencies and the footer
+    """
+    yield plantuml_header()
+    yield from iter_tables(tables, memo)
+    yield plantuml_footer()
+
+
+def write_plantuml_tables(
+    tables: Tables, output: TextIO, memo: Optional[TableMemo] = None
+):
+    """
+    Writes the PlantUML source code into any text sink as soon as every table
+    is generated
+    """
+    for chunk in iter_plantuml_tables(tables, memo):
+        output.write(chunk)
 
 
 def plantuml_header():
@@ -34,16 +145,21 @@ def plantuml_header():
     return header
 
 
-def gen_tables(tables: Tables):
+def gen_tables(tables: Tables, memo: Optional[TableMemo] = None) -> str:
     """
     Generates the PlantUML source code out of the Tables object
     """
-    code = ""
+    return "".join(iter_tables(tables, memo))
+
+
+def iter_tables(
+    tables: Tables, memo: Optional[TableMemo] = None
+) -> Iterator[str]:
+    render = gen_table if memo is None else memo.render
     for t in tables:
-        code += gen_table(t)
+        yield render(t)
 
-    code += gen_tables_dependencies(tables)
-    return code
+    yield gen_tables_dependencies(tables)
 
 
 def plantuml_footer():
@@ -52,97 +168,80 @@ def plantuml_footer():
 
 def gen_table(table: Table) -> str:
     t = table
-    # Table header
-    code = "{}({}) {{\n".format(table_macros(t.engine), str(t))
-
-    code += addSpaces(gen_table_engine(t))
-    code += addSpaces(gen_table_columns(t))
-
-    # Table footer
-    code += "}\n\n"
-    return code
+    return "".join(
+        (
+            # Table header
+            "{}({}) {{\n".format(table_macros(t.engine), str(t)),
+            addSpaces(gen_table_engine(t)),
+            addSpaces(gen_table_columns(t)),
+            # Table footer
+            "}\n\n",
+        )
+    )
 
 
 def gen_tables_dependencies(tables: Tables) -> str:
-    code = ""
-    for t in tables:
-        code += "".join(
-            "{} -|> {}\n".format(str(t), d)
-            for d in t.dependencies
-            if d in tables.as_dict
-        )
+    return "".join(iter_tables_dependencies(tables))
 
-        code += "".join(
-            "{} -|> {}\n".format(r, str(t))
-            for r in t.rev_dependencies
-            if r in tables.as_dict
-        )
-    return code
+
+def iter_tables_dependencies(tables: Tables) -> Iterator[str]:
+    for source, target in DependencyGraph(tables):
+        yield "{} -|> {}\n".format(source, target)
 
 
 def table_macros(table_type: str):
-    if table_type in ("MaterializedView", "View", "Distributed"):
-        return table_type
-    return "Table"
+    return MACROS.get(table_type, "Table")
 
 
 def gen_table_engine(table: Table) -> str:
     t = table
-    code = "ENGINE=**{}**\n".format(t.engine)
+    code = ["ENGINE=**{}**\n".format(t.engine)]
     if t.engine_config:
-        code += "..engine config..\n"
-    for k, v in t.engine_config:
-        code += "{}: {}\n".format(k, v)
+        code.append("..engine config..\n")
+    code.extend("{}: {}\n".format(k, v) for k, v in t.engine_config)
 
     if t.replication_config:
-        code += "..replication..\n"
-    for k, v in t.replication_config:
-        code += "{}: {}\n".format(k, v)
+        code.append("..replication..\n")
+    code.extend("{}: {}\n".format(k, v) for k, v in t.replication_config)
 
-    return code
+    return "".join(code)
 
 
 def gen_table_columns(table: Table) -> str:
     t = table
-    table_keys = ["partition", "sorting", "sampling"]
+    table_keys = TABLE_KEYS
     if t.sorting_key != t.primary_key:
         # If primary != sorting, it's worth to append it
-        table_keys.insert(2, "primary")
+        table_keys = TABLE_KEYS_WITH_PRIMARY
 
-    code = "==columns==\n"
-    for c in t.columns:
-        code += "{}: {}{}\n".format(c.name, c.type, column_keys(c, table_keys))
+    code = ["==columns==\n"]
+    code.extend(
+        "{}: {}{}\n".format(c.name, c.type, column_keys(c, table_keys))
+        for c in t.columns
+    )
 
     for k in table_keys:
-        key_string = getattr(t, "{}_key".format(k))
+        key_string = getattr(t, TABLE_KEY_ATTRS[k])
         if key_string:
-            code += "..{}{} key..\n{}\n".format(
-                column_key_sign(k), k, key_string
-            )
+            code.append(KEY_HEADERS[k])
+            code.append(key_string + "\n")
 
-    return code
+    return "".join(code)
 
 
 def column_key_sign(key: str) -> str:
-    sign = "<size:15><&{}></size>"
-    if key == "partition":
-        return sign.format("list-rich")
-    if key == "sorting":
-        return sign.format("signal")
-    if key == "primary":
-        return sign.format("key")
-    if key == "sampling":
-        return sign.format("collapse-down")
-    return ""
-
-
-def column_keys(column: Column, table_keys: List[str]) -> str:
-    code = ""
-
-    for key in table_keys:
-        if getattr(column, "is_in_{}_key".format(key)):
-            code += " {}".format(column_key_sign(key))
-    return code
+    return KEY_SIGNS.get(key, "")
+
+
+def column_keys(column: Column, table_keys: Sequence[str]) -> str:
+    return "".join(
+        COLUMN_KEY_SUFFIXES.get(key, " ")
+        for key in table_keys
+        if getattr(
+            column,
+            COLUMN_KEY_ATTRS.get(key) or "is_in_{}_key".format(key),
+        )
+    )
 
 
 def addSpaces(lines: str, amount: int = 2) -> str:
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+
+# License: Apache-2.0
+# Copyright (C) 2020 Mikhail f. Shiryaev
+
+import logging
+import os
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from hashlib import sha1
+from subprocess import Popen, PIPE
+from typing import Dict, List, Optional, Sequence
+from uuid import uuid4
+
+from .timing import profiler
+
+logger = logging.getLogger("clickhouse-plantuml")
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+    "clickhouse-plantuml",
+)
+
+
+def write_file(path: str, data: bytes):
+    """
+    Writes the data to a temporary file next to the path and renames it, so
+    the path is never left half written
+    """
+    tmp_path = "{}.{}.tmp".format(path, uuid4().hex)
+    try:
+        with open(tmp_path, "bw") as out:
+            out.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class PlantUML(object):
+    """
+    Long living `plantuml -pipe` process. Diagrams are rendered one by one
+    through it, so the JVM is started only once
+
+    Parameters
+    ----------
+    plantuml_format : `str`
+        PlantUML output format, e.g. `png` or `svg`
+    arguments : `Sequence[str]`
+        additional parameters to pass into plantuml command
+    command : `Sequence[str]`
+        the command to run plantuml
+    """
+
+    def __init__(
+        self,
+        plantuml_format: str = "png",
+        arguments: Sequence[str] = (),
+        command: Sequence[str] = ("plantuml",),
+    ):
+        delimiter = "CLICKHOUSE_PLANTUML_{}".format(uuid4().hex)
+        self.command = list(command) + [
+            "-pipe",
+            "-pipedelimitor",
+            delimiter,
+            "-t" + plantuml_format,
+        ]
+        self.command.extend(arguments)
+        # plantuml prints the delimiter in a separate line after each diagram
+        self._delimiter = re.compile(re.escape(delimiter.encode()) + b"\r?\n")
+        self._buffer = b""
+        self._lock = threading.Lock()
+        self._proc = None  # type: Optional[Popen]
+
+    def render(self, diagram: str) -> bytes:
+        """
+        Returns the rendered diagram
+        """
+        with self._lock:
+            if self._proc is None or self._proc.poll() is not None:
+                self._start()
+            diagram_bin = diagram.encode("UTF-8")
+            if not diagram_bin.endswith(b"\n"):
+                diagram_bin += b"\n"
+            self._proc.stdin.write(diagram_bin)
+            self._proc.stdin.flush()
+            return self._read()
+
+    def close(self):
+        with self._lock:
+            if self._proc is None:
+                return
+            self._proc.stdin.close()
+            self._proc.wait()
+            self._proc.stdout.close()
+            self._proc = None
+
+    def _start(self):
+        logger.debug("Starting {}".format(" ".join(self.command)))
+        self._buffer = b""
+        self._proc = Popen(self.command, stdin=PIPE, stdout=PIPE)
+
+    def _read(self) -> bytes:
+        fd = self._proc.stdout.fileno()
+        while True:
+            match = self._delimiter.search(self._buffer)
+            if match:
+                result = self._buffer[: match.start()]
+                self._buffer = self._buffer[match.end() :]
+                return result
+            chunk = os.read(fd, 1 << 16)
+            if not chunk:
+                self._proc.wait()
+                raise RuntimeError(
+                    "plantuml exited with code {}".format(self._proc.returncode)
+                )
+            self._buffer += chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RenderPool(object):
+    """
+    Renders diagrams in parallel by a bounded amount of workers. Each worker
+    keeps a :class:`PlantUML` process per output format
+
+    Parameters
+    ----------
+    workers : `int`
+        maximum number of diagrams rendered at once
+    arguments : `Sequence[str]`
+        additional parameters to pass into plantuml command
+    command : `Sequence[str]`
+        the command to run plantuml
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        arguments: Sequence[str] = (),
+        command: Sequence[str] = ("plantuml",),
+    ):
+        self.arguments = arguments
+        self.command = command
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1))
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._processes = []  # type: List[PlantUML]
+
+    def submit(self, diagram: str, plantuml_format: str = "png") -> Future:
+        """
+        Schedules the diagram rendering, the future's result is the rendered
+        diagram
+        """
+        return self._executor.submit(self._render, diagram, plantuml_format)
+
+    def render(self, diagram: str, plantuml_format: str = "png") -> bytes:
+        return self.submit(diagram, plantuml_format).result()
+
+    def close(self):
+        self._executor.shutdown()
+        with self._lock:
+            for proc in self._processes:
+                proc.close()
+            self._processes = []
+
+    def _render(self, diagram: str, plantuml_format: str) -> bytes:
+        processes = getattr(
+            self._local, "processes", None
+        )  # type: Optional[Dict[str, PlantUML]]
+        if processes is None:
+            processes = self._local.processes = {}
+        if plantuml_format not in processes:
+            proc = PlantUML(plantuml_format, self.arguments, self.command)
+            processes[plantuml_format] = proc
+            with self._lock:
+                self._processes.append(proc)
+        with profiler.span("run plantuml") as span:
+            data = processes[plantuml_format].render(diagram)
+            span.bytes = len(data)
+        return data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RenderCache(object):
+    """
+    Content addressed storage of rendered diagrams. The least recently used
+    diagrams are evicted when the total size exceeds the limit
+
+    Parameters
+    ----------
+    directory : `str`
+        the cache directory, created if necessary
+    max_size : `int`
+        maximum size of the cache in bytes
+    """
+
+    def __init__(self, directory: str, max_size: int = 256 << 20):
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(
+        diagram: str, plantuml_format: str, arguments: Sequence[str] = ()
+    ) -> str:
+        """
+        Returns the cache key for the diagram rendered with the format and
+        plantuml arguments
+        """
+        key = sha1()
+        key.update(plantuml_format.encode("UTF-8") + b"\0")
+        key.update("\0".join(arguments).encode("UTF-8") + b"\0")
+        key.update(diagram.encode("UTF-8"))
+        return key.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the path of the cached diagram or None. The diagram is marked
+        as recently used
+        """
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, key: str, data: bytes) -> str:
+        """
+        Stores the rendered diagram and returns its path
+        """
+        path = self.path(key)
+        tmp_path = "{}.{}.tmp".format(path, uuid4().hex)
+        with open(tmp_path, "bw") as out:
+            out.write(data)
+        # The new diagram is kept even if it's bigger than the cache
+        self.evict(len(data))
+        os.replace(tmp_path, path)
+        return path
+
+    def copy(self, key: str, destination: str):
+        """
+        Copies the cached diagram to the destination. It's never linked, so
+        changes of the output do not touch the cache and vice versa
+        """
+        with open(self.path(key), "rb") as cached:
+            write_file(destination, cached.read())
+
+    def evict(self, reserve: int = 0):
+        """
+        Removes the least recently used diagrams until the cache and
+        `reserve` bytes fit the size limit
+        """
+        with self._lock:
+            files = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if not entry.is_file() or entry.name.endswith(".tmp"):
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+            files.sort()
+            for _, size, path in files:
+                if total + reserve <= self.max_size:
+                    break
+                logger.debug("Evict %s from the render cache", path)
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
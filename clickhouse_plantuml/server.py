@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+
+# License: Apache-2.0
+# Copyright (C) 2020 Mikhail f. Shiryaev
+
+"""
+HTTP service with diagrams of a ClickHouse server, e.g.
+`python -m clickhouse_plantuml serve --host clickhouse`. The diagrams are
+served by paths `/database/DATABASE.FORMAT` and
+`/focus/DATABASE.TABLE.FORMAT?depth=N`, where FORMAT is `puml`, `svg` or `png`
+"""
+
+import logging
+import threading
+
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, Namespace
+from hashlib import sha1
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from pprint import pformat
+from socketserver import ThreadingMixIn
+from time import monotonic
+from typing import Dict, List, Optional, Tuple, Union
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from . import ClientPool, ClickHouseSource, Source, Tables
+from .client import Client, split_host
+from .plantuml import TableMemo, plantuml_tables
+from .render import DEFAULT_CACHE_DIR, RenderCache, RenderPool
+
+logger = logging.getLogger("clickhouse-plantuml")
+
+CONTENT_TYPES = {
+    "puml": "text/plain; charset=utf-8",
+    "svg": "image/svg+xml",
+    "png": "image/png",
+}
+
+# The kind of the diagram, its database or focus table, and the depth
+DiagramKey = Tuple[str, str, int]
+
+
+class Diagrams(object):
+    """
+    Diagrams of a server. The tables and the diagram source are kept for
+    `ttl` seconds, rendered diagrams are kept in the cache by the content
+    hash, so they are rendered again only when the diagram is changed
+
+    Parameters
+    ----------
+    client : `Union[Client, ClientPool, Source]`
+        the client or the source to get tables from, see :class:`Tables`.
+        Diagrams are loaded concurrently only through the pool
+    renderer : `RenderPool`
+        the pool to render diagrams
+    cache : `RenderCache`
+        the cache of rendered diagrams, if omitted they are rendered for
+        every request
+    ttl : `float`
+        seconds to keep tables before querying them again
+    columnar : `bool`
+        see :class:`ClickHouseSource`
+    """
+
+    def __init__(
+        self,
+        client: Union[Client, ClientPool, Source],
+        renderer: RenderPool,
+        cache: Optional[RenderCache] = None,
+        ttl: float = 60.0,
+        columnar: bool = False,
+    ):
+        self.source = client
+        if not isinstance(client, Source):
+            self.source = ClickHouseSource(client, columnar)
+        # A single client can't run queries concurrently
+        self._queries = None  # type: Optional[threading.Lock]
+        if isinstance(client, Client):
+            self._queries = threading.Lock()
+        self.renderer = renderer
+        self.cache = cache
+        self.ttl = ttl
+        self.memo = TableMemo()
+        # The memo is shared by all diagrams and is not thread-safe
+        self._memo_lock = threading.Lock()
+        # Protects only the dicts below
+        self._lock = threading.Lock()
+        # Loading time and diagram source by the key
+        self._diagrams = {}  # type: Dict[DiagramKey, Tuple[float, str]]
+        # Locks of diagrams being loaded
+        self._loading = {}  # type: Dict[DiagramKey, threading.Lock]
+
+    def diagram(self, kind: str, name: str, depth: int = 1) -> str:
+        """
+        Returns the source of the diagram of the `database` or the `focus`
+        table, or an empty string if there are no tables
+        """
+        key = (kind, name, depth)
+        with self._lock:
+            loading = self._loading.setdefault(key, threading.Lock())
+        # Concurrent requests of the same diagram wait for one query
+        with loading:
+            cached = self._diagrams.get(key)
+            if cached is not None and monotonic() - cached[0] < self.ttl:
+                return cached[1]
+            now = monotonic()
+            if self._queries is None:
+                tables = self._tables(kind, name, depth)
+            else:
+                with self._queries:
+                    tables = self._tables(kind, name, depth)
+            diagram = ""
+            if tables:
+                with self._memo_lock:
+                    diagram = plantuml_tables(tables, self.memo)
+            with self._lock:
+                self._diagrams = {
+                    k: v
+                    for k, v in self._diagrams.items()
+                    if now - v[0] < self.ttl
+                }
+                self._diagrams[key] = (now, diagram)
+                self._loading = {
+                    k: v
+                    for k, v in self._loading.items()
+                    if k in self._diagrams or v.locked()
+                }
+            return diagram
+
+    def _tables(self, kind: str, name: str, depth: int) -> Tables:
+        if kind == "database":
+            return Tables(self.source, [name])
+        return Tables(self.source, focus=[name], depth=depth)
+
+    def etag(self, diagram: str, plantuml_format: str) -> str:
+        """
+        Returns the entity tag of the diagram in the format, it's known
+        before the diagram is rendered
+        """
+        if plantuml_format == "puml":
+            return sha1(diagram.encode("UTF-8")).hexdigest()
+        return RenderCache.key(
+            diagram, plantuml_format, self.renderer.arguments
+        )
+
+    def content(self, diagram: str, plantuml_format: str) -> bytes:
+        """
+        Returns the diagram in the format, rendered or taken from the cache
+        """
+        if plantuml_format == "puml":
+            return diagram.encode("UTF-8")
+        if self.cache is None:
+            return self.renderer.render(diagram, plantuml_format)
+        key = self.etag(diagram, plantuml_format)
+        path = self.cache.get(key)
+        if path is not None:
+            try:
+                with open(path, "rb") as cached:
+                    return cached.read()
+            except FileNotFoundError:
+                # Evicted between the check and the read
+                pass
+        data = self.renderer.render(diagram, plantuml_format)
+        self.cache.put(key, data)
+        return data
+
+
+class DiagramHandler(BaseHTTPRequestHandler):
+    """
+    Serves diagrams of the server's :class:`Diagrams`. Responses have the
+    ETag header, and `If-None-Match` with the same tag is answered by
+    304 Not Modified without rendering
+    """
+
+    server_version = "clickhouse-plantuml"
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] not in ("database", "focus"):
+            self.send_error(404, "Unknown path")
+            return
+        kind = parts[0]
+        name, _, plantuml_format = unquote(parts[1]).rpartition(".")
+        if not name or plantuml_format not in CONTENT_TYPES:
+            self.send_error(404, "Unknown format")
+            return
+        if kind == "focus" and "." not in name:
+            self.send_error(404, "Focus table must be DATABASE.TABLE")
+            return
+        try:
+            depth = int(parse_qs(url.query).get("depth", ["1"])[0])
+        except ValueError:
+            self.send_error(400, "Depth must be an integer")
+            return
+
+        diagrams = self.server.diagrams  # type: Diagrams
+        try:
+            diagram = diagrams.diagram(kind, name, depth)
+        except Exception as e:
+            logger.error("Failed to get tables of %s: %s", name, e)
+            self.send_error(502, "Failed to get tables")
+            return
+        if not diagram:
+            self.send_error(404, "There are no tables")
+            return
+
+        etag = '"{}"'.format(diagrams.etag(diagram, plantuml_format))
+        if self._not_modified(etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        try:
+            data = diagrams.content(diagram, plantuml_format)
+        except Exception as e:
+            logger.error("Failed to render %s: %s", name, e)
+            self.send_error(500, "Failed to render the diagram")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[plantuml_format])
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        # Clients revalidate every time, the answer is cheap when unchanged
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _not_modified(self, etag: str) -> bool:
+        header = self.headers.get("If-None-Match")
+        if header is None:
+            return False
+        tags = [t.strip() for t in header.split(",")]
+        return "*" in tags or etag in tags or "W/" + etag in tags
+
+    def log_message(self, format, *args):
+        logger.info("%s - " + format, self.address_string(), *args)
+
+
+class DiagramServer(ThreadingMixIn, HTTPServer):
+    """
+    HTTP server handling every request in a separate thread
+
+    Parameters
+    ----------
+    address : `Tuple[str, int]`
+        the address and the port to listen
+    diagrams : `Diagrams`
+        diagrams to serve
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], diagrams: Diagrams):
+        super().__init__(address, DiagramHandler)
+        self.diagrams = diagrams
+
+
+def parse_args(argv: Optional[List[str]] = None) -> Namespace:
+    parser = ArgumentParser(
+        prog="clickhouse-plantuml serve",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+        description="Serves PlantUML diagrams of ClickHouse databases by "
+        "HTTP: /database/DATABASE.FORMAT and /focus/DATABASE.TABLE.FORMAT"
+        "?depth=N, FORMAT is puml, svg or png",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="set the script verbosity, could be used multiple",
+    )
+    clickhouse = parser.add_argument_group("ClickHouse parameters")
+    clickhouse.add_argument(
+        "--host",
+        default="localhost",
+        help="ClickHouse server hostname, `host:port` is accepted as well",
+    )
+    clickhouse.add_argument(
+        "--port",
+        default=9000,
+        type=int,
+        help="ClickHouse server port",
+    )
+    clickhouse.add_argument(
+        "-u",
+        "--user",
+        default="default",
+        help="ClickHouse username",
+    )
+    clickhouse.add_argument(
+        "-p",
+        "--password",
+        default="",
+        help="ClickHouse password",
+    )
+    clickhouse.add_argument(
+        "--columnar",
+        action="store_true",
+        help="receive query results in columnar form, it's faster for big "
+        "amount of columns",
+    )
+    clickhouse.add_argument(
+        "--timeout",
+        default=10.0,
+        type=float,
+        help="connect and send/receive timeout, seconds",
+    )
+    clickhouse.add_argument(
+        "--pool-size",
+        default=4,
+        type=int,
+        help="maximum number of connections, diagrams are loaded "
+        "concurrently through them",
+    )
+    clickhouse.add_argument(
+        "--ttl",
+        default=60.0,
+        type=float,
+        help="seconds to keep tables of a diagram before querying them again",
+    )
+
+    server = parser.add_argument_group("HTTP parameters")
+    server.add_argument(
+        "--listen",
+        default="127.0.0.1",
+        help="address to listen",
+    )
+    server.add_argument(
+        "--listen-port",
+        default=8080,
+        type=int,
+        help="port to listen",
+    )
+
+    plantuml = parser.add_argument_group("PlantUml parameters")
+    plantuml.add_argument(
+        "--plantuml-arguments",
+        default="",
+        help="additional parameters to pass into plantuml command",
+    )
+    plantuml.add_argument(
+        "--plantuml-workers",
+        default=2,
+        type=int,
+        help="maximum number of diagrams rendered in parallel, each worker "
+        "keeps its own plantuml process",
+    )
+    plantuml.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help="directory to keep rendered diagrams, they are reused for the "
+        "same diagram source, format and plantuml arguments",
+    )
+    plantuml.add_argument(
+        "--cache-size",
+        default=256,
+        type=int,
+        help="maximum size of the rendered diagrams cache, MiB. The least "
+        "recently used diagrams are removed above it",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    log_levels = [logging.CRITICAL, logging.WARN, logging.INFO, logging.DEBUG]
+    logger.setLevel(log_levels[min(args.verbose, 3)])
+    logger.debug("Arguments are %s", pformat(args.__dict__))
+    hostname, port = split_host(args.host, args.port)
+    client = ClientPool(
+        host=hostname,
+        port=port,
+        user=args.user,
+        password=args.password,
+        connect_timeout=args.timeout,
+        send_receive_timeout=args.timeout,
+        size=args.pool_size,
+    )
+    renderer = RenderPool(
+        args.plantuml_workers, args.plantuml_arguments.split()
+    )
+    diagrams = Diagrams(
+        client,
+        renderer,
+        RenderCache(args.cache_dir, args.cache_size << 20),
+        args.ttl,
+        args.columnar,
+    )
+    server = DiagramServer((args.listen, args.listen_port), diagrams)
+    logger.info("Listening on %s:%s", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Server is stopped")
+    finally:
+        server.server_close()
+        renderer.close()
+        client.disconnect()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# License: Apache-2.0
+# Copyright (C) 2020 Mikhail f. Shiryaev
+
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+logger = logging.getLogger("clickhouse-plantuml")
+
+
+class Snapshot(object):
+    """
+    Saved rows of **system.tables** and **system.columns** for a selection of
+    databases and tables
+
+    Parameters
+    ----------
+    databases : `List[str]`
+    tables : `List[str]`
+        the selection the snapshot is made for
+    rows : `Dict[str, Dict[str, Any]]`
+        rows of **system.tables** by `database.name`
+    mtimes : `Dict[str, int]`
+        tables' `metadata_modification_time` as unix timestamps
+    columns : `Dict[str, List[Sequence[Any]]]`
+        rows of **system.columns** by `database.table`, as `Column` arguments
+    patterns : `List[str]`
+        the selection's patterns, see :meth:`Patterns.key`
+    """
+
+    VERSION = 3
+
+    def __init__(
+        self,
+        databases: List[str],
+        tables: Optional[List[str]],
+        rows: Dict[str, Dict[str, Any]] = None,
+        mtimes: Dict[str, int] = None,
+        columns: Dict[str, List[Sequence[Any]]] = None,
+        patterns: Optional[List[str]] = None,
+    ):
+        self.databases = sorted(databases)
+        self.tables = sorted(tables or [])
+        self.rows = rows or {}
+        self.mtimes = mtimes or {}
+        self.columns = columns or {}
+        self.patterns = sorted(patterns or [])
+
+    def matches(
+        self,
+        databases: List[str],
+        tables: Optional[List[str]],
+        patterns: Optional[List[str]] = None,
+    ):
+        """
+        Checks if the snapshot is made for the same selection
+        """
+        return (
+            self.databases == sorted(databases)
+            and self.tables == sorted(tables or [])
+            and self.patterns == sorted(patterns or [])
+        )
+
+    @classmethod
+    def load(cls, path: str) -> Optional["Snapshot"]:
+        """
+        Returns the snapshot from the file, or None if it does not exist or
+        is not compatible
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning("Snapshot {} is broken: {}".format(path, e))
+            return None
+        if data.get("version") != cls.VERSION:
+            return None
+        return cls(
+            data["databases"],
+            data["tables"],
+            data["rows"],
+            data["mtimes"],
+            data["columns"],
+            data["patterns"],
+        )
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "version": self.VERSION,
+                    "databases": self.databases,
+                    "tables": self.tables,
+                    "rows": self.rows,
+                    "mtimes": self.mtimes,
+                    "columns": self.columns,
+                    "patterns": self.patterns,
+                },
+                f,
+                separators=(",", ":"),
+            )
+        os.replace(tmp_path, path)
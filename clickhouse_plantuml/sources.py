@@ -0,0 +1,701 @@
+#!/usr/bin/env python
+
+# License: Apache-2.0
+# Copyright (C) 2020 Mikhail f. Shiryaev
+
+import json
+import re
+from datetime import datetime
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+from . import Client, ClientPool
+from .client import dict_row, tuple_row
+from .timing import Span, profiler
+
+Row = Dict[str, Any]
+ColumnRow = Sequence[Any]
+Pairs = Sequence[Tuple[str, str]]
+
+# Bigger sets of (database, table) pairs are sent as an external table
+MAX_INLINE_PAIRS = 1000
+
+TABLES_QUERY = """
+    SELECT
+        database,
+        name,
+        arrayMap((x, y) -> concat(x, '.', y), dependencies_database,
+                 dependencies_table) AS dependencies,
+        create_table_query,
+        engine,
+        engine_full,
+        partition_key,
+        sorting_key,
+        primary_key,
+        sampling_key
+    FROM system.tables
+    WHERE {where}
+    ORDER BY database, name
+    """
+
+METADATA_QUERY = """
+    SELECT
+        database,
+        name,
+        toUnixTimestamp(metadata_modification_time) AS mtime,
+        arrayMap((x, y) -> concat(x, '.', y), dependencies_database,
+                 dependencies_table) AS dependencies
+    FROM system.tables
+    WHERE {where}
+    ORDER BY database, name
+    """
+
+FINGERPRINT_QUERY = """
+    SELECT
+        database,
+        count() AS tables,
+        max(toUnixTimestamp(metadata_modification_time)) AS mtime
+    FROM system.tables
+    WHERE {where}
+    GROUP BY database
+    ORDER BY database
+    """
+
+COLUMNS_QUERY = """
+    SELECT
+        database,
+        table,
+        name,
+        type,
+        default_kind,
+        default_expression,
+        comment,
+        compression_codec,
+        is_in_partition_key,
+        is_in_sorting_key,
+        is_in_primary_key,
+        is_in_sampling_key
+    FROM system.columns
+    WHERE {where}
+    """
+
+TABLES_FIELDS = (
+    "database",
+    "name",
+    "dependencies",
+    "create_table_query",
+    "engine",
+    "engine_full",
+    "partition_key",
+    "sorting_key",
+    "primary_key",
+    "sampling_key",
+)
+
+COLUMNS_FIELDS = (
+    "database",
+    "table",
+    "name",
+    "type",
+    "default_kind",
+    "default_expression",
+    "comment",
+    "compression_codec",
+    "is_in_partition_key",
+    "is_in_sorting_key",
+    "is_in_primary_key",
+    "is_in_sampling_key",
+)
+
+
+def with_inner(tables: List[str]) -> List[str]:
+    """
+    Here's a trick to get both normal and MV inner tables
+    """
+    return tables + [".inner." + t for t in tables]
+
+
+class Patterns(object):
+    """
+    Regular expressions to select tables. A table is selected if its database
+    matches any of `databases`, its name matches any of `tables`, and
+    `database.table` matches none of `exclude`. Empty lists do not restrict
+    anything. MV inner tables are matched without `.inner.` prefix, so they
+    follow their views. Expressions are searched in names with ClickHouse
+    `match()` on the server, or `re.search` locally
+
+    Parameters
+    ----------
+    databases : `List[str]`
+    tables : `List[str]`
+    exclude : `List[str]`
+    """
+
+    def __init__(
+        self,
+        databases: Sequence[str] = (),
+        tables: Sequence[str] = (),
+        exclude: Sequence[str] = (),
+    ):
+        self.databases = list(databases)
+        self.tables = list(tables)
+        self.exclude = list(exclude)
+        self._compiled = None  # type: Optional[Tuple[List[Any], ...]]
+
+    def __bool__(self):
+        return bool(self.databases or self.tables or self.exclude)
+
+    def key(self) -> List[str]:
+        """
+        Returns the list identifying the selection, e.g. for snapshots
+        """
+        return (
+            ["d:" + p for p in self.databases]
+            + ["t:" + p for p in self.tables]
+            + ["x:" + p for p in self.exclude]
+        )
+
+    def where(self, table_column: str = "name") -> Tuple[str, Dict[str, Any]]:
+        """
+        Returns WHERE conditions and parameters for **system.tables**, or for
+        **system.columns** with `table_column="table"`
+        """
+        name = r"replaceRegexpOne({}, '^\\.inner\\.', '')".format(table_column)
+        conditions = []
+        params = {}  # type: Dict[str, Any]
+
+        def any_match(column: str, prefix: str, patterns: List[str]) -> str:
+            matches = []
+            for i, p in enumerate(patterns):
+                params["{}{}".format(prefix, i)] = p
+                matches.append("match({}, %({}{})s)".format(column, prefix, i))
+            return "({})".format(" OR ".join(matches))
+
+        if self.databases:
+            conditions.append(any_match("database", "dp", self.databases))
+        if self.tables:
+            conditions.append(any_match(name, "tp", self.tables))
+        if self.exclude:
+            full_name = "concat(database, '.', {})".format(name)
+            conditions.append("NOT " + any_match(full_name, "xp", self.exclude))
+        return " AND ".join(conditions), params
+
+    def match(self, database: str, table: str) -> bool:
+        """
+        Checks the table locally
+        """
+        if self._compiled is None:
+            self._compiled = tuple(
+                [re.compile(p) for p in patterns]
+                for patterns in (self.databases, self.tables, self.exclude)
+            )
+        databases, tables, exclude = self._compiled
+        if table.startswith(".inner."):
+            table = table[7:]
+        full_name = "{}.{}".format(database, table)
+        return (
+            (not databases or any(p.search(database) for p in databases))
+            and (not tables or any(p.search(table) for p in tables))
+            and not any(p.search(full_name) for p in exclude)
+        )
+
+
+class Source(object):
+    """
+    Base class for the rows of **system.tables** and **system.columns**
+    consumed by :class:`Tables`. Tables are returned as dictionaries with the
+    same keys as the `Table` arguments. Columns are returned as tuples in
+    :data:`COLUMNS_FIELDS` order, the same as `Column` arguments.
+    """
+
+    columnar = False
+
+    def get_tables(
+        self,
+        databases: List[str],
+        tables: Optional[List[str]] = None,
+        patterns: Optional[Patterns] = None,
+    ) -> Iterable[Row]:
+        """
+        Returns tables of the databases ordered by database and name. If
+        `tables` is set, only they and their MV inner tables are returned.
+        If `patterns` are set, only matching tables are returned, and empty
+        `databases` do not restrict anything
+        """
+        raise NotImplementedError
+
+    def get_tables_by_pairs(self, pairs: Pairs) -> Iterable[Row]:
+        """
+        Returns tables by exact (database, name) pairs
+        """
+        raise NotImplementedError
+
+    def get_referring_tables(self, names: Iterable[str]) -> Iterable[Row]:
+        """
+        Returns tables which may refer to any of `database.table` names: by
+        `dependencies`, as Distributed or Buffer target, or as
+        MaterializedView data table. Extra tables are allowed, the caller
+        checks the references
+        """
+        raise NotImplementedError
+
+    def get_metadata(
+        self,
+        databases: List[str],
+        tables: Optional[List[str]] = None,
+        patterns: Optional[Patterns] = None,
+    ) -> Iterable[Row]:
+        """
+        Same as :meth:`get_tables`, but returns only `database`, `name`,
+        `mtime` (metadata_modification_time unix timestamp) and `dependencies`
+        """
+        raise NotImplementedError
+
+    def get_fingerprint(
+        self,
+        databases: List[str],
+        tables: Optional[List[str]] = None,
+        patterns: Optional[Patterns] = None,
+    ) -> Dict[str, Tuple[int, int]]:
+        """
+        Returns the number of tables and the latest metadata modification
+        time by database, for the same selection as :meth:`get_tables`. It's
+        a cheap way to detect schema changes
+        """
+        raise NotImplementedError
+
+    def get_columns(self, pairs: Pairs) -> Iterable[ColumnRow]:
+        """
+        Returns columns of the tables by exact (database, table) pairs
+        """
+        raise NotImplementedError
+
+    def get_columns_of(
+        self,
+        databases: List[str],
+        tables: Optional[List[str]] = None,
+        patterns: Optional[Patterns] = None,
+    ) -> Iterable[ColumnRow]:
+        """
+        Returns columns of the tables selected as in :meth:`get_tables`. It
+        does not need the tables, so both could be queried concurrently
+        """
+        raise NotImplementedError
+
+    def get_columns_columnar(self, pairs: Pairs) -> List[Sequence[Any]]:
+        """
+        Same as :meth:`get_columns`, but returns the list of fields' data in
+        :data:`COLUMNS_FIELDS` order. It's preferred by :class:`Tables` if
+        :attr:`columnar` is set
+        """
+        return [list(f) for f in zip(*self.get_columns(pairs))]
+
+    def get_columns_columnar_of(
+        self,
+        databases: List[str],
+        tables: Optional[List[str]] = None,
+        patterns: Optional[Patterns] = None,
+    ) -> List[Sequence[Any]]:
+        """
+        Same as :meth:`get_columns_of`, but returns the fields' data as
+        :meth:`get_columns_columnar`
+        """
+        return [
+            list(f)
+            for f in zip(*self.get_columns_of(databases, tables, patterns))
+        ]
+
+    def get_table_names(
+        self, databases: Iterable[str]
+    ) -> Iterable[Tuple[str, str]]:
+        """
+        Returns (database, name) pairs of all tables in the databases
+        """
+        raise NotImplementedError
+
+
+class ClickHouseSource(Source):
+    """
+    Gets rows from a ClickHouse server
+
+    Parameters
+    ----------
+    client : `Union[Client, ClientPool]`
+    columnar : `bool`
+        if set, queries are executed in columnar mode, so the driver does not
+        transpose the received blocks into rows
+    """
+
+    def __init__(
+        self, client: Union[Client, ClientPool], columnar: bool = False
+    ):
+        self.client = client
+        self.columnar = columnar
+
+    def _execute_iter_rows(
+        self, query: str, params: Dict[str, Any], row_factory=dict_row, **kwargs
+    ) -> Iterable[Any]:
+        if not self.columnar:
+            return profiler.iterate(
+                _span_name(query),
+                self.client.execute_iter_rows(
+                    query, params, row_factory=row_factory, **kwargs
+                ),
+                self._received,
+            )
+        data, names = self._execute_columnar(query, params, **kwargs)
+        make_row = row_factory(names)
+        rows = zip(*data)
+        return rows if make_row is None else map(make_row, rows)
+
+    def _execute_columnar(
+        self, query: str, params: Dict[str, Any], **kwargs
+    ) -> Tuple[List[Sequence[Any]], List[str]]:
+        with profiler.span(_span_name(query)) as span:
+            data, names = self.client.execute_columnar(query, params, **kwargs)
+            span.rows = len(data[0]) if data else 0
+            self._received(span)
+        return data, names
+
+    def _received(self, span: Span):
+        """
+        Adds bytes of the last query result to the span, if the client
+        tracks them
+        """
+        last_query = getattr(self.client, "last_query", None)
+        if last_query is not None:
+            span.bytes += last_query.profile_info.bytes
+
+    @staticmethod
+    def _tables_where(
+        databases: List[str],
+        tables: Optional[List[str]] = None,
+        patterns: Optional[Patterns] = None,
+        table_column: str = "name",
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Returns WHERE clause and parameters for **system.tables** queries, or
+        **system.columns** ones with `table_column="table"`
+        """
+        conditions = []
+        params = {}  # type: Dict[str, Any]
+        if databases or not patterns:
+            conditions.append("database IN %(ds)s")
+            params["ds"] = tuple(databases)
+        if tables:
+            conditions.append("{} IN %(ns)s".format(table_column))
+            params["ns"] = tuple(with_inner(tables))
+        if patterns:
+            where, patterns_params = patterns.where(table_column)
+            conditions.append(where)
+            params.update(patterns_params)
+        return " AND ".join(conditions), params
+
+    @staticmethod
+    def _pairs_where(
+        pairs: Pairs, table_column: str = "name"
+    ) -> Tuple[str, Dict[str, Any], Dict[str, Any]]:
+        """
+        Returns WHERE clause, parameters and `execute` keyword arguments to
+        select exact (database, table) pairs. `database IN ... AND table IN
+        ...` would be a cross product and bring not selected tables. Above
+        :data:`MAX_INLINE_PAIRS` the pairs are sent as the `_pairs` external
+        table, inlined they'd exceed `max_query_size`
+        """
+        pairs = tuple(pairs)
+        if len(pairs) <= MAX_INLINE_PAIRS:
+            where = "(database, {}) IN %(pairs)s".format(table_column)
+            return where, {"pairs": pairs}, {}
+        external = {
+            "name": "_pairs",
+            "structure": [("database", "String"), ("table", "String")],
+            "data": [{"database": d, "table": t} for d, t in pairs],
+        }
+        where = "(database, {}) IN _pairs".format(table_column)
+        return where, {}, {"external_tables": [external]}
+
+    def get_tables(self, databases, tables=None, patterns=None):
+        where, params = self._tables_where(databases, tables, patterns)
+        return self._execute_iter_rows(TABLES_QUERY.format(where=where), params)
+
+    def get_tables_by_pairs(self, pairs):
+        where, params, kwargs = self._pairs_where(pairs)
+        return self._execute_iter_rows(
+            TABLES_QUERY.format(where=where), params, **kwargs
+        )
+
+    def get_referring_tables(self, names):
+        names = sorted(names)
+        # Engines' arguments could be quoted in any way, so the bare table
+        # name is searched there
+        return self._execute_iter_rows(
+            TABLES_QUERY.format(where="""
+                hasAny(arrayMap((x, y) -> concat(x, '.', y),
+                                dependencies_database, dependencies_table),
+                       %(names)s)
+                OR (engine IN ('Distributed', 'Buffer')
+                    AND arrayExists(n -> position(engine_full, n) > 0,
+                                    %(ns)s))
+                OR (engine = 'MaterializedView'
+                    AND arrayExists(n -> position(create_table_query, n) > 0,
+                                    %(names)s))
+                """),
+            {
+                "names": names,
+                "ns": sorted({n.split(".", 1)[-1] for n in names}),
+            },
+        )
+
+    def get_metadata(self, databases, tables=None, patterns=None):
+        where, params = self._tables_where(databases, tables, patterns)
+        return self._execute_iter_rows(
+            METADATA_QUERY.format(where=where), params
+        )
+
+    def get_fingerprint(self, databases, tables=None, patterns=None):
+        where, params = self._tables_where(databases, tables, patterns)
+        return {
+            r["database"]: (r["tables"], r["mtime"])
+            for r in self._execute_iter_rows(
+                FINGERPRINT_QUERY.format(where=where), params
+            )
+        }
+
+    def get_columns(self, pairs):
+        where, params, kwargs = self._pairs_where(pairs, "table")
+        return self._execute_iter_rows(
+            COLUMNS_QUERY.format(where=where),
+            params,
+            row_factory=tuple_row,
+            **kwargs
+        )
+
+    def get_columns_of(self, databases, tables=None, patterns=None):
+        where, params = self._tables_where(databases, tables, patterns, "table")
+        return self._execute_iter_rows(
+            COLUMNS_QUERY.format(where=where), params, row_factory=tuple_row
+        )
+
+    def get_columns_columnar(self, pairs):
+        where, params, kwargs = self._pairs_where(pairs, "table")
+        data, _ = self._execute_columnar(
+            COLUMNS_QUERY.format(where=where), params, **kwargs
+        )
+        return data
+
+    def get_columns_columnar_of(self, databases, tables=None, patterns=None):
+        where, params = self._tables_where(databases, tables, patterns, "table")
+        data, _ = self._execute_columnar(
+            COLUMNS_QUERY.format(where=where), params
+        )
+        return data
+
+    def get_table_names(self, databases):
+        return (
+            (r["database"], r["name"])
+            for r in self._execute_iter_rows(
+                """
+                SELECT database, name
+                FROM system.tables
+                WHERE database IN %(ds)s
+                ORDER BY database, name
+                """,
+                {"ds": tuple(databases)},
+            )
+        )
+
+
+_QUERY_TABLE = re.compile(r"\bFROM\s+(system\.\w+)")
+
+
+def _span_name(query: str) -> str:
+    match = _QUERY_TABLE.search(query)
+    return "query " + match.group(1) if match else "query"
+
+
+_TSV_ESCAPE = re.compile(r"\\(.)", re.DOTALL)
+_TSV_ESCAPES = {
+    "b": "\b",
+    "f": "\f",
+    "r": "\r",
+    "n": "\n",
+    "t": "\t",
+    "0": "\0",
+}
+_ARRAY_STRING = re.compile(r"'((?:[^'\\]|\\.)*)'", re.DOTALL)
+
+
+def _tsv_unescape(value: str) -> str:
+    if "\\" not in value:
+        return value
+    return _TSV_ESCAPE.sub(
+        lambda m: _TSV_ESCAPES.get(m.group(1), m.group(1)), value
+    )
+
+
+def _array(value: Any) -> List[str]:
+    """
+    Returns the Array(String) value, TSV dumps have it as a text like
+    `['a','b']`, JSON ones as a list
+    """
+    if isinstance(value, str):
+        return [_tsv_unescape(v) for v in _ARRAY_STRING.findall(value)]
+    return list(value)
+
+
+def read_dump(lines: Iterable[str]) -> Iterable[Row]:
+    """
+    Reads rows of JSONEachRow or TSVWithNames dump, the format is detected
+    by the first line. TSV values are strings, arrays are parsed by the
+    row builders for the known columns
+    """
+    lines = iter(lines)
+    first = next(lines, "")
+    if first.lstrip().startswith("{"):
+        yield json.loads(first)
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+        return
+
+    names = first.rstrip("\r\n").split("\t")
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line:
+            yield dict(zip(names, map(_tsv_unescape, line.split("\t"))))
+
+
+def _mtime(value: Any) -> int:
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return int(datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp())
+
+
+def _table_row(row: Row) -> Row:
+    if "dependencies" in row:
+        row["dependencies"] = _array(row["dependencies"])
+    else:
+        row["dependencies"] = [
+            "{}.{}".format(d, t)
+            for d, t in zip(
+                _array(row.get("dependencies_database", [])),
+                _array(row.get("dependencies_table", [])),
+            )
+        ]
+    return {f: row.get(f, "") for f in TABLES_FIELDS}
+
+
+def _column_row(row: Row) -> ColumnRow:
+    column = [row.get(f, "") for f in COLUMNS_FIELDS]
+    for i in range(8, 12):
+        # is_in_*_key are UInt8, TSV values are strings
+        column[i] = int(column[i] or 0)
+    return tuple(column)
+
+
+class DumpSource(Source):
+    """
+    Gets rows from saved dumps of **system.tables** and **system.columns**,
+    so no server is needed. Dumps are JSONEachRow or TSVWithNames, e.g.:
+
+        clickhouse-client -q 'SELECT * FROM system.tables FORMAT JSONEachRow'
+
+    Parameters
+    ----------
+    tables : `Iterable[str]`
+        lines of the system.tables dump, e.g. an opened file
+    columns : `Iterable[str]`
+        lines of the system.columns dump
+    """
+
+    def __init__(self, tables: Iterable[str], columns: Iterable[str]):
+        self.tables = {}  # type: Dict[Tuple[str, str], Row]
+        self.mtimes = {}  # type: Dict[Tuple[str, str], int]
+        for r in read_dump(tables):
+            key = (r["database"], r["name"])
+            self.mtimes[key] = _mtime(r.get("metadata_modification_time", 0))
+            self.tables[key] = _table_row(r)
+        self.columns = {}  # type: Dict[Tuple[str, str], List[ColumnRow]]
+        for r in read_dump(columns):
+            self.columns.setdefault((r["database"], r["table"]), []).append(
+                _column_row(r)
+            )
+
+    def _select(
+        self,
+        databases: List[str],
+        tables: Optional[List[str]] = None,
+        patterns: Optional[Patterns] = None,
+    ) -> List[Tuple[str, str]]:
+        databases_set = set(databases) if databases or not patterns else None
+        tables_set = set(with_inner(tables)) if tables else None
+        return sorted(
+            k
+            for k in self.tables
+            if (databases_set is None or k[0] in databases_set)
+            and (tables_set is None or k[1] in tables_set)
+            and (not patterns or patterns.match(*k))
+        )
+
+    def get_tables(self, databases, tables=None, patterns=None):
+        return (
+            dict(self.tables[k])
+            for k in self._select(databases, tables, patterns)
+        )
+
+    def get_tables_by_pairs(self, pairs):
+        return (
+            dict(self.tables[k]) for k in sorted(set(pairs)) if k in self.tables
+        )
+
+    def get_referring_tables(self, names):
+        names = set(names)
+        ns = {n.split(".", 1)[-1] for n in names}
+        return (
+            dict(r)
+            for _, r in sorted(self.tables.items())
+            if not names.isdisjoint(r["dependencies"])
+            or any(n in r["engine_full"] for n in ns)
+            or any(n in r["create_table_query"] for n in names)
+        )
+
+    def get_metadata(self, databases, tables=None, patterns=None):
+        return (
+            {
+                "database": k[0],
+                "name": k[1],
+                "mtime": self.mtimes[k],
+                "dependencies": list(self.tables[k]["dependencies"]),
+            }
+            for k in self._select(databases, tables, patterns)
+        )
+
+    def get_fingerprint(self, databases, tables=None, patterns=None):
+        fingerprint = {}  # type: Dict[str, Tuple[int, int]]
+        for database, name in self._select(databases, tables, patterns):
+            count, mtime = fingerprint.get(database, (0, 0))
+            fingerprint[database] = (
+                count + 1,
+                max(mtime, self.mtimes[(database, name)]),
+            )
+        return fingerprint
+
+    def get_columns(self, pairs):
+        return (c for k in pairs for c in self.columns.get(tuple(k), []))
+
+    def get_columns_of(self, databases, tables=None, patterns=None):
+        return self.get_columns(self._select(databases, tables, patterns))
+
+    def get_table_names(self, databases):
+        databases_set = set(databases)
+        return sorted(k for k in self.tables if k[0] in databases_set)
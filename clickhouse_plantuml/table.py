@@ -3,11 +3,103 @@
 # License: Apache-2.0
 # Copyright (C) 2020 Mikhail f. Shiryaev
 
-from typing import List, Tuple, Optional
+import re
+from typing import List, Optional, Tuple
 from . import Client, Column
-from token import tok_name
-from tokenize import generate_tokens
-from io import StringIO
+
+# The engine name and the opening parenthesis of its arguments
+_ENGINE_NAME = re.compile(r"\s*\w+\s*\(")
+_ENGINE_TOKENS = re.compile(
+    r"""
+    (?P<quoted>
+        '(?:[^'\\]|\\.|'')*'
+        |"(?:[^"\\]|\\.|"")*"
+        |`(?:[^`\\]|\\.|``)*`
+    )
+    |(?P<open>\()
+    |(?P<close>\))
+    |(?P<comma>,)
+    |(?P<space>\s+)
+    |(?P<other>[^'"`(),\s]+)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+_ESCAPES = {
+    "b": "\b",
+    "f": "\f",
+    "r": "\r",
+    "n": "\n",
+    "t": "\t",
+    "0": "\0",
+    "a": "\a",
+    "v": "\v",
+}
+_ESCAPE_SEQUENCES = {
+    q: re.compile(r"\\x([0-9a-fA-F]{2})|\\(.)|(" + q * 2 + ")", re.DOTALL)
+    for q in "'\"`"
+}
+
+
+def _unescape(match) -> str:
+    if match.group(1):
+        return chr(int(match.group(1), 16))
+    if match.group(2):
+        return _ESCAPES.get(match.group(2), match.group(2))
+    # Doubled quote
+    return match.group(3)[0]
+
+
+def _unquote(literal: str) -> str:
+    """
+    Returns the content of ClickHouse quoted string literal or identifier
+    """
+    quote = literal[0]
+    value = literal[1:-1]
+    if "\\" in value or quote * 2 in value:
+        value = _ESCAPE_SEQUENCES[quote].sub(_unescape, value)
+    return value
+
+
+def parse_engine_args(engine_full: str) -> List[str]:
+    """
+    Single pass scanner of the engine arguments in the `engine_full` string.
+
+    Returns the list of top level arguments with unquoted literals. The
+    whitespaces out of the literals are dropped, so nested expressions are
+    returned as `cityHash64(Path)` or `toYYYYMM(toStartOfDay(Date,'UTC'))`.
+    """
+    match = _ENGINE_NAME.match(engine_full)
+    if match is None:
+        # Engine without arguments
+        return []
+
+    engine_args = []  # type: List[str]
+    stack = 1
+    for token in _ENGINE_TOKENS.finditer(engine_full, match.end()):
+        kind = token.lastgroup
+        config_element = token.group()
+        if kind == "space":
+            continue
+        elif kind == "open":
+            # Counting config depth
+            stack += 1
+        elif kind == "close":
+            stack -= 1
+            if stack == 0:
+                # The config is over
+                break
+        elif kind == "comma" and stack == 1:
+            engine_args.append("")
+            continue
+        elif kind == "quoted":
+            config_element = _unquote(config_element)
+
+        if not engine_args:
+            engine_args.append("")
+
+        engine_args[-1] += config_element
+
+    return engine_args
 
 
 class Table(object):
@@ -37,6 +129,24 @@ class Table(object):
         Engine's arguments
     """
 
+    __slots__ = (
+        "database",
+        "name",
+        "dependencies",
+        "rev_dependencies",
+        "create_table_query",
+        "engine",
+        "engine_full",
+        "partition_key",
+        "sorting_key",
+        "primary_key",
+        "sampling_key",
+        "columns",
+        "engine_config",
+        "replication_config",
+        "__engine_args",
+    )
+
     def __init__(
         self,
         database: str,
@@ -52,7 +162,8 @@ class Table(object):
     ):
         self.database = database
         self.name = name
-        self.dependencies = dependencies
+        # The list is extended by engines, e.g. Buffer
+        self.dependencies = list(dependencies)
         self.rev_dependencies = []  # type: List[str]
         self.create_table_query = create_table_query
         self.engine = engine
@@ -82,12 +193,17 @@ class Table(object):
         Parses :attr:`engine_full` and gets key-value parameters for known
         tables engines. Adds new attributes.
 
+        Parameters
+        ----------
+        client : `Optional[Client]`
+            unused and kept for compatibility, Merge tables are resolved by
+            :meth:`Tables._resolve_merges`
+
         Attributes
         ----------
         engine_config : `List[Tuple[str, str]]`
             ordered key-velue parameters for engine
         """
-        self._client = client or None
         self._parse_engine_config()
         self.engine_config = []  # type: List[Tuple[str, str]]
         self.replication_config = []  # type: List[Tuple[str, str]]
@@ -99,7 +215,6 @@ class Table(object):
 
         if hasattr(self, engine_method):
             getattr(self, engine_method)()
-        delattr(self, "_client")
 
     def _replicated(self):
         """
@@ -161,18 +276,12 @@ class Table(object):
         )
 
     def _merge(self):
+        """
+        :attr:`rev_dependencies` are resolved for all Merge tables at once by
+        :meth:`Tables._resolve_merges`
+        """
         self._append_engine_config("database")
         self._append_engine_config("table_re")
-        rdeps_rows = self._client.execute(
-            """
-            SELECT groupArray(concat(database, '.', name)) AS rdeps
-            FROM system.tables
-            WHERE database = %(db)s
-                AND match(name, %(re)s)
-            """,
-            {"db": self.engine_config[0][1], "re": self.engine_config[1][1]},
-        )
-        self.rev_dependencies = list(rdeps_rows["rdeps"])
 
     def _join(self):
         self._append_engine_config("strictness")
@@ -205,48 +314,7 @@ class Table(object):
         Helper for parsing engine_full string and write list of parameters to
         :attr:`__engine_args`
         """
-        tokens = generate_tokens(StringIO(self.engine_full).readline)
-        engine_args = []  # type: List[str]
-        stack = 0
-        for tok in tokens:
-            exact_type = tok_name[tok.exact_type]
-            if exact_type == "LPAR":
-                # Counting config depth
-                stack += 1
-                config_element = tok.string
-                if stack == 1:
-                    # If it's the first level - continue
-                    continue
-            elif exact_type == "RPAR":
-                stack -= 1
-                config_element = tok.string
-                if stack == 0:
-                    # The config is over
-                    break
-            elif exact_type == "COMMA" and stack == 1:
-                # Collect commas from subconfigs
-                # This is error prune in case of wrong config, e.g.:
-                # SomeEngine('parameter1',)
-                # But this is comming from ClickHouse server,
-                # so we should be safe
-                engine_args.append("")
-                continue
-            elif exact_type == "STRING":
-                # Get strings from raw config strings
-                config_element = eval(tok.string)
-            else:
-                config_element = tok.string
-
-            if not stack:
-                # continue unless we're in config parenthesis
-                continue
-
-            if not engine_args:
-                engine_args.append("")
-
-            engine_args[-1] += config_element
-
-        self.__engine_args = engine_args
+        self.__engine_args = parse_engine_args(self.engine_full)
 
     def __str__(self):
         return "{}.{}".format(self.database, self.name)
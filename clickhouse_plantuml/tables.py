@@ -5,106 +5,390 @@
 
 import logging
 import re
-from typing import List, Dict
+from collections import OrderedDict
+from itertools import groupby, islice
+from operator import itemgetter
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 from collections.abc import MutableSequence
-from . import Client, Column, Table
+from . import Client, ClientPool, Column, Table
+from .snapshot import Snapshot
+from .sources import ClickHouseSource, ColumnRow, Patterns, Source
+from .timing import profiler
 
 logger = logging.getLogger("clickhouse-plantuml")
 
+MV_TO = re.compile(r"^CREATE MATERIALIZED VIEW \S+ TO (\S+)")
+
+
+def mv_data_table(mv: Table) -> str:
+    """
+    Returns the name of MaterializedView's data table
+    """
+    match = MV_TO.search(mv.create_table_query)
+    if match:
+        # MV is created TO specific data table
+        return match[1]
+    # MV is created to the default .inner. data table
+    return "{}..inner.{}".format(mv.database, mv.name)
+
+
+def references(table: Table) -> List[str]:
+    """
+    Returns names of tables the table is linked with by its own attributes:
+    `dependencies`, `rev_dependencies`, Distributed and Buffer targets,
+    MaterializedView data table, and the view of `.inner.` table. Engine must
+    be parsed
+    """
+    t = table
+    names = t.dependencies + t.rev_dependencies
+    if t.engine == "MaterializedView":
+        names.append(mv_data_table(t))
+    elif t.name.startswith(".inner."):
+        names.append("{}.{}".format(t.database, t.name[7:]))
+    return names
+
+
+def split_name(name: str) -> Tuple[str, str]:
+    database, _, table = name.partition(".")
+    return database, table
+
 
 class Tables(MutableSequence):
     """
     List of table objects
+
+    Parameters
+    ----------
+    client : `Union[Client, ClientPool, Source]`
+        the client or the pool of clients to query ClickHouse server, or any
+        other tables source, e.g. :class:`DumpSource`
+    databases : `List[str]`
+        databases to get tables from
+    tables : `List[str]`
+        tables whitelist
+    snapshot : `str`
+        the snapshot file path. If set, only tables changed since the
+        snapshot are fetched from the server
+    focus : `List[str]`
+        `database.table` names. If set, only these tables and their
+        neighbours up to `depth` links away are fetched, databases and tables
+        are ignored
+    depth : `int`
+        number of links to follow from the `focus` tables
+    patterns : `Patterns`
+        regular expressions to select tables on the server. If set, empty
+        `databases` mean all databases
     """
 
     def __init__(
         self,
-        client: Client,
+        client: Union[Client, ClientPool, Source],
         databases: List[str] = None,
         tables: List[str] = None,
+        snapshot: str = None,
+        focus: List[str] = None,
+        depth: int = 1,
+        patterns: Patterns = None,
     ):
         self.client = client
-        self.__list = list()  # type: List[Table]
-        self.as_dict = dict()  # type: Dict[str, Table]
-        if databases:
-            self._get_tables(databases, tables)
+        if isinstance(client, Source):
+            self.source = client
+        else:
+            self.source = ClickHouseSource(client)
+        # Tables by name in the insertion order. The list is built on demand
+        # for access by index and is reset on every modification
+        self.as_dict = OrderedDict()  # type: Dict[str, Table]
+        self.__list = None  # type: Optional[List[Table]]
+        if focus:
+            self._get_tables_focus(focus, depth)
             self._get_columns()
             self._merge_matviews()
+        elif (databases or patterns) and snapshot:
+            self._get_tables_snapshot(databases, tables, snapshot, patterns)
+            self._merge_matviews()
+        elif databases or patterns:
+            self._get_tables(databases, tables, patterns)
+            if tables:
+                self._get_columns()
+            else:
+                self._get_columns_of(databases, patterns)
+            self._merge_matviews()
+
+    def _list(self) -> List[Table]:
+        if self.__list is None:
+            self.__list = list(self.as_dict.values())
+        return self.__list
 
     def __delitem__(self, i):
         if isinstance(i, int):
-            key = str(self.__list[i])
-            del self.__list[i]
-            _ = self.as_dict.pop(key)
+            key = str(self._list()[i])
         elif isinstance(i, str):
-            table = self.as_dict.pop(i)
-            self.__list.remove(table)
+            key = i
         elif isinstance(i, Table):
-            self.__list.remove(i)
-            _ = self.as_dict.pop(str(i))
+            key = str(i)
         else:
             raise ValueError("Use index, table name or Table object")
+        del self.as_dict[key]
+        self.__list = None
 
     def __setitem__(self, i, t):
         if not isinstance(t, Table):
             raise ValueError("Must be an instance of Table")
-        current = self.__list[i]
-        self.__list[i] = t
-        del self.as_dict[str(current)]
-        self.as_dict[str(t)] = t
+        current = self._list()[i]
+        if str(current) == str(t):
+            self.as_dict[str(t)] = t
+        else:
+            items = list(self.as_dict.items())
+            items[items.index((str(current), current))] = (str(t), t)
+            self.as_dict = OrderedDict(items)
+        self.__list = None
 
     def __getitem__(self, i):
-        logger.debug("Check for i {} in self".format(i))
-        if isinstance(i, int):
-            return self.__list[i]
-        elif isinstance(i, str):
+        # Lookups by name are the hot path
+        if isinstance(i, str):
             return self.as_dict[i]
+        elif isinstance(i, (int, slice)):
+            return self._list()[i]
 
     def __len__(self):
-        return len(self.__list)
+        return len(self.as_dict)
+
+    def __iter__(self):
+        return iter(self.as_dict.values())
+
+    def __contains__(self, t):
+        if isinstance(t, str):
+            return t in self.as_dict
+        return self.as_dict.get(str(t)) is t
 
     def insert(self, i, t):
+        """
+        Inserts the table before index. A table with the same name is
+        replaced. Appending is O(1), inserting in the middle is O(n)
+        """
         if not isinstance(t, Table):
             raise ValueError("Must be an instance of Table")
-        self.__list.insert(i, t)
-        self.as_dict[str(t)] = t
-
-    def _get_tables(self, databases: List[str], tables: List[str] = None):
-        query = """
-            SELECT
-                database,
-                name,
-                arrayMap((x, y) -> concat(x, '.', y), dependencies_database,
-                         dependencies_table) AS dependencies,
-                create_table_query,
-                engine,
-                engine_full,
-                partition_key,
-                sorting_key,
-                primary_key,
-                sampling_key
-            FROM system.tables
-            WHERE database IN %(ds)s
-                {name_clause}
-            ORDER BY database, name
-            """
-        if tables:
-            query = query.format(name_clause="AND name IN %(ns)s")
-            # Here's a trick to get both normal and
-            tables += [".inner." + t for t in tables]
-            data = self.client.execute_iter_dict(
-                query, {"ds": tuple(databases), "ns": tuple(tables)}
-            )
+        self.as_dict.pop(str(t), None)
+        if i >= len(self.as_dict):
+            self.as_dict[str(t)] = t
         else:
-            query = query.format(name_clause="")
-            data = self.client.execute_iter_dict(
-                query,
-                {"ds": tuple(databases)},
+            items = list(self.as_dict.items())
+            items.insert(i, (str(t), t))
+            self.as_dict = OrderedDict(items)
+        self.__list = None
+
+    def remove(self, t):
+        """
+        Removes the table by name in O(1)
+        """
+        if t not in self:
+            raise ValueError("{} is not in tables".format(t))
+        del self[t]
+
+    def reverse(self):
+        self.as_dict = OrderedDict(reversed(list(self.as_dict.items())))
+        self.__list = None
+
+    def _get_tables(
+        self,
+        databases: List[str],
+        tables: List[str] = None,
+        patterns: Patterns = None,
+    ):
+        self._build_tables(self.source.get_tables(databases, tables, patterns))
+        self._resolve_merges(set() if tables or patterns else set(databases))
+
+    def _get_tables_snapshot(
+        self,
+        databases: List[str],
+        tables: List[str],
+        path: str,
+        patterns: Patterns = None,
+    ):
+        """
+        Gets tables and columns using the snapshot file. Only tables with
+        changed `metadata_modification_time` are fetched from the server,
+        the dropped are detected by the list of names. The snapshot is
+        updated afterwards
+        """
+        snapshot = Snapshot.load(path)
+        selection = patterns.key() if patterns else []
+        if snapshot is None or not snapshot.matches(
+            databases, tables, selection
+        ):
+            snapshot = Snapshot(databases, tables, patterns=selection)
+
+        metadata = list(self.source.get_metadata(databases, tables, patterns))
+        changed = tuple(
+            (m["database"], m["name"])
+            for m in metadata
+            if snapshot.mtimes.get("{database}.{name}".format(**m))
+            != m["mtime"]
+        )
+        logger.info(
+            "{} of {} tables are changed since the snapshot".format(
+                len(changed), len(metadata)
+            )
+        )
+        rows = {}  # type: Dict[str, Dict[str, Any]]
+        columns = {
+            "{}.{}".format(*p): [] for p in changed
+        }  # type: Dict[str, List[ColumnRow]]
+        if changed:
+            for r in self.source.get_tables_by_pairs(changed):
+                rows["{database}.{name}".format(**r)] = r
+            for c in self.source.get_columns(changed):
+                columns["{}.{}".format(c[0], c[1])].append(c)
+
+        current = Snapshot(databases, tables, patterns=selection)
+        # Tables are built in the metadata order, dicts are unordered on
+        # Python 3.5
+        names = []  # type: List[str]
+        for m in metadata:
+            name = "{database}.{name}".format(**m)
+            if name in rows:
+                current.rows[name] = rows[name]
+            elif name in snapshot.rows:
+                # Dependencies are not a part of the table metadata
+                current.rows[name] = snapshot.rows[name]
+                current.rows[name]["dependencies"] = m["dependencies"]
+            else:
+                # The table is created between queries
+                continue
+            names.append(name)
+            current.mtimes[name] = m["mtime"]
+            current.columns[name] = columns.get(name) or snapshot.columns.get(
+                name, []
             )
 
-        self.extend(Table(**r) for r in data)
-        for t in self:
-            t.parse_engine(self.client)
+        self._build_tables(current.rows[n] for n in names)
+        self._resolve_merges(set() if tables or patterns else set(databases))
+        self._add_columns(c for t in self for c in current.columns[str(t)])
+        current.save(path)
+
+    def _get_tables_focus(self, focus: List[str], depth: int):
+        """
+        Gets tables breadth-first from the focus ones. Every hop fetches the
+        tables referenced by the previous hop, and the tables referring to it
+        """
+        new = self._get_tables_by_names(focus)
+        for hop in range(depth):
+            if not new:
+                break
+            frontier = {str(t) for t in new}
+            new = self._get_tables_by_names(
+                {n for t in new for n in references(t)}
+            )
+            # The source may return extra tables, only real referrers are kept
+            new.extend(
+                self._with_data_tables(
+                    self._build_tables(
+                        self.source.get_referring_tables(frontier),
+                        lambda t: not frontier.isdisjoint(references(t)),
+                    )
+                )
+            )
+            logger.info("Hop %s added %s tables", hop + 1, len(new))
+
+        # No database is fully loaded
+        self._resolve_merges(set())
+
+    def _get_tables_by_names(self, names: Iterable[str]) -> List[Table]:
+        """
+        Gets tables absent in self by `database.table` names with their MV
+        data tables. Returns the added tables
+        """
+        pairs = tuple(split_name(n) for n in names if n not in self.as_dict)
+        if not pairs:
+            return []
+        return self._with_data_tables(
+            self._build_tables(self.source.get_tables_by_pairs(pairs))
+        )
+
+    def _with_data_tables(self, tables: List[Table]) -> List[Table]:
+        """
+        MaterializedView is merged with its data table, so they are fetched
+        together
+        """
+        pairs = tuple(
+            split_name(mv_data_table(t))
+            for t in tables
+            if t.engine == "MaterializedView"
+            and mv_data_table(t) not in self.as_dict
+        )
+        if not pairs:
+            return tables
+        return tables + self._build_tables(
+            self.source.get_tables_by_pairs(pairs)
+        )
+
+    @profiler.timed("build tables")
+    def _build_tables(
+        self,
+        rows: Iterable[Dict[str, Any]],
+        accept: Callable[[Table], bool] = None,
+    ) -> List[Table]:
+        """
+        Creates tables absent in self, parses their engines and appends the
+        accepted ones. Returns the appended tables
+        """
+        tables = [
+            Table(**r)
+            for r in rows
+            if "{database}.{name}".format(**r) not in self.as_dict
+        ]
+        with profiler.span("parse_engine") as span:
+            span.rows = len(tables)
+            for t in tables:
+                t.parse_engine()
+        if accept is not None:
+            tables = [t for t in tables if accept(t)]
+        self.extend(tables)
+        return tables
+
+    @profiler.timed("resolve merges")
+    def _resolve_merges(self, loaded: Set[str]):
+        """
+        Fills `rev_dependencies` of Merge tables. The tables of `loaded`, fully
+        loaded databases, are matched locally, the rest are fetched by a single
+        query for all Merge tables together
+        """
+        merges = [t for t in self if t.engine == "Merge"]
+        if not merges:
+            return
+
+        remote = {dict(t.engine_config)["database"] for t in merges} - loaded
+        names = [(t.database, t.name) for t in self if t.database in loaded]
+        if remote:
+            names.extend(self.source.get_table_names(remote))
+
+        for t in merges:
+            config = dict(t.engine_config)
+            try:
+                pattern = re.compile(config["table_re"])
+            except re.error:
+                logger.warning(
+                    "Unable to match tables for {}: {}".format(
+                        str(t), config["table_re"]
+                    )
+                )
+                continue
+            t.rev_dependencies = [
+                "{}.{}".format(db, name)
+                for db, name in names
+                if db == config["database"] and pattern.search(name)
+            ]
 
     def _get_columns(self):
         """
@@ -112,33 +396,61 @@ class Tables(MutableSequence):
         """
         if not self:
             return
-        tables = {t.name for t in self}
-        databases = {t.database for t in self}
-        columns_data = self.client.execute_iter_dict(
-            """
-            SELECT
-                database,
-                table,
-                name,
-                type,
-                default_kind,
-                default_expression,
-                comment,
-                is_in_partition_key,
-                is_in_sorting_key,
-                is_in_primary_key,
-                is_in_sampling_key,
-                compression_codec
-            FROM system.columns
-            WHERE database IN %(ds)s
-                AND table IN %(ts)s
-            """,
-            {"ds": tuple(databases), "ts": tuple(tables)},
-        )
-        for c in columns_data:
-            column = Column(**c)
-            self[column.db_table].add_column(column)
+        pairs = tuple((t.database, t.name) for t in self)
+        if self.source.columnar:
+            self._add_columns_columnar(self.source.get_columns_columnar(pairs))
+        else:
+            self._add_columns(self.source.get_columns(pairs))
+
+    def _get_columns_of(self, databases: List[str], patterns: Patterns):
+        """
+        Get columns of whole databases or patterns by the same selection as
+        tables, so the query does not grow with the number of tables
+        """
+        if not self:
+            return
+        if self.source.columnar:
+            self._add_columns_columnar(
+                self.source.get_columns_columnar_of(databases, None, patterns)
+            )
+        else:
+            self._add_columns(
+                self.source.get_columns_of(databases, None, patterns)
+            )
+
+    @profiler.timed("add columns")
+    def _add_columns(self, columns_data: Iterable[ColumnRow]):
+        """
+        Columns of a table come one after another, so the table is looked up
+        once per group of rows. Columns of unknown tables are skipped, e.g.
+        of ones created after the tables were queried
+        """
+        for (database, table), rows in groupby(columns_data, itemgetter(0, 1)):
+            t = self.as_dict.get("{}.{}".format(database, table))
+            if t is not None:
+                t.columns.extend(Column(*c) for c in rows)
 
+    @profiler.timed("add columns")
+    def _add_columns_columnar(self, columns_data: Sequence[Sequence[Any]]):
+        """
+        Same as :meth:`_add_columns`, but for data in columnar form. Columns
+        are created right from the fields' data without rows
+        """
+        if not columns_data:
+            return
+        fields = [iter(f) for f in columns_data]
+        for (database, table), rows in groupby(
+            zip(columns_data[0], columns_data[1])
+        ):
+            length = len(list(rows))
+            t = self.as_dict.get("{}.{}".format(database, table))
+            if t is None:
+                for f in fields:
+                    next(islice(f, length - 1, None), None)
+                continue
+            t.columns.extend(map(Column, *(islice(f, length) for f in fields)))
+
+    @profiler.timed("merge matviews")
     def _merge_matviews(self):
         """
         MATERIALIZED VIEW is presented in a database as two tables:
@@ -157,16 +469,9 @@ class Tables(MutableSequence):
         if not mat_views:
             return
 
-        pattern = re.compile(r"^CREATE MATERIALIZED VIEW \S+ TO (\S+)")
         for mv in mat_views:
-            logger.debug("{} config: {}".format(mv.name, mv.engine_config))
-            match = re.search(pattern, mv.create_table_query)
-            if match:
-                # MV is created TO specific data table
-                data_table = match[1]
-            else:
-                # MV is created to the default .inner. data table
-                data_table = "{}..inner.{}".format(mv.database, mv.name)
+            logger.debug("%s config: %s", mv.name, mv.engine_config)
+            data_table = mv_data_table(mv)
             if data_table not in self.as_dict:
                 # The data table is not in the tables list
                 # Possible reason: it's in another database or not in the
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+# License: Apache-2.0
+# Copyright (C) 2020 Mikhail f. Shiryaev
+
+import json
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None  # type: ignore
+
+logger = logging.getLogger("clickhouse-plantuml")
+
+
+class Span(object):
+    """
+    Time spent in a phase, the rows and bytes it processed. Spans of the same
+    name are summed up by :class:`Profiler`
+
+    Parameters
+    ----------
+    name : `str`
+        the phase name, e.g. `query system.tables` or `parse_engine`
+    """
+
+    __slots__ = ("name", "calls", "seconds", "rows", "bytes")
+
+    def __init__(
+        self,
+        name: str,
+        calls: int = 1,
+        seconds: float = 0.0,
+        rows: int = 0,
+        bytes: int = 0,
+    ):
+        self.name = name
+        self.calls = calls
+        self.seconds = seconds
+        self.rows = rows
+        self.bytes = bytes
+
+    def add(self, span: "Span"):
+        self.calls += span.calls
+        self.seconds += span.seconds
+        self.rows += span.rows
+        self.bytes += span.bytes
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+Hook = Callable[[Span], Any]
+
+
+class Profiler(object):
+    """
+    Collects timing spans of the phases. Nothing is measured until it's
+    enabled. Spans could be nested, e.g. queries are a part of loading, so
+    their times overlap. The module-level :data:`profiler` is used by
+    :class:`Tables`, :class:`ClickHouseSource` and the script
+
+    Parameters
+    ----------
+    enabled : `bool`
+        if set, spans are measured
+
+    Attributes
+    ----------
+    spans : `Dict[str, Span]`
+        total spans by name in the order of the first occurrence
+    hooks : `List[Callable[[Span], Any]]`
+        functions called with every finished span, e.g. to send it into a
+        metrics system. They are called in the thread of the span
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.spans = OrderedDict()  # type: Dict[str, Span]
+        self.hooks = []  # type: List[Hook]
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[Span]:
+        """
+        Measures the block, the yielded span could be updated with rows and
+        bytes. The span is recorded even if the block is failed
+        """
+        span = Span(name)
+        if not self.enabled:
+            yield span
+            return
+        start = perf_counter()
+        try:
+            yield span
+        finally:
+            span.seconds = perf_counter() - start
+            self.record(span)
+
+    def timed(self, name: str) -> Callable[[Callable], Callable]:
+        """
+        Decorator measuring every call of the function as the span
+        """
+
+        def decorator(function: Callable) -> Callable:
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def iterate(
+        self,
+        name: str,
+        rows: Iterable[Any],
+        finish: Optional[Callable[[Span], Any]] = None,
+    ) -> Iterable[Any]:
+        """
+        Measures the time of getting rows and counts them. The consumer's
+        time is not included, so it's suitable for lazily fetched query
+        results. `finish` is called with the span when rows are exhausted
+        """
+        if not self.enabled:
+            return rows
+        return self._iterate(Span(name), iter(rows), finish)
+
+    def _iterate(
+        self,
+        span: Span,
+        rows: Iterator[Any],
+        finish: Optional[Callable[[Span], Any]],
+    ) -> Iterator[Any]:
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    span.seconds += perf_counter() - start
+                    break
+                span.seconds += perf_counter() - start
+                span.rows += 1
+                yield row
+            if finish is not None:
+                finish(span)
+        finally:
+            self.record(span)
+
+    def record(self, span: Span):
+        """
+        Adds the finished span to the totals and passes it to the hooks
+        """
+        with self._lock:
+            total = self.spans.get(span.name)
+            if total is None:
+                self.spans[span.name] = Span(span.name, 0)
+                total = self.spans[span.name]
+            total.add(span)
+        for hook in self.hooks:
+            try:
+                hook(span)
+            except Exception as e:
+                logger.warning("Profiler hook failed on %s: %s", span.name, e)
+
+    def reset(self):
+        with self._lock:
+            self.spans = OrderedDict()
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            spans = [s.as_dict() for s in self.spans.values()]
+        return {"spans": spans, "peak_memory": peak_memory()}
+
+    def report(self, output_format: str = "table") -> str:
+        """
+        Returns the summary of spans as a text table or JSON
+        """
+        data = self.as_dict()
+        if output_format == "json":
+            return json.dumps(data, indent=2) + "\n"
+        lines = [
+            "{:<32} {:>7} {:>10} {:>10} {:>12}".format(
+                "span", "calls", "seconds", "rows", "bytes"
+            )
+        ]
+        lines.extend(
+            "{name:<32} {calls:>7} {seconds:>10.3f} {rows:>10} {bytes:>12}"
+            "".format(**s)
+            for s in data["spans"]
+        )
+        if data["peak_memory"] is not None:
+            lines.append(
+                "peak memory: {} MiB".format(data["peak_memory"] >> 20)
+            )
+        return "\n".join(lines) + "\n"
+
+
+def peak_memory() -> Optional[int]:
+    """
+    Returns the peak resident set size of the process in bytes, or None if
+    it's unknown on the platform
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # It's in kilobytes everywhere, but in bytes on macOS
+    if sys.platform == "darwin":
+        return maxrss
+    return maxrss << 10
+
+
+profiler = Profiler()
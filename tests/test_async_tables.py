@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from clickhouse_plantuml import AsyncTables
+from clickhouse_plantuml.async_tables import load_hosts
+from tests.test_tables import column_row, table_row
+
+TABLES = {
+    "db1": [
+        table_row("db1", "events"),
+        table_row("db1", "merge", "Merge", "Merge(db2, '^u')"),
+    ],
+    "db2": [table_row("db2", "users")],
+}
+COLUMNS = {
+    "db1": [column_row("db1", "events", "id"), column_row("db1", "new", "id")],
+    "db2": [column_row("db2", "users", "id")],
+}
+
+
+class FakeClient(object):
+    """
+    Answers queries by the database, every query waits for the barrier
+    """
+
+    def __init__(self, barrier=None):
+        self.barrier = barrier
+
+    def execute_iter_rows(self, query, params=None, row_factory=None):
+        if self.barrier is not None:
+            self.barrier.wait()
+        (database,) = params["ds"]
+        if "system.columns" in query:
+            return iter(COLUMNS[database])
+        if "SELECT database, name" in query:
+            return iter([(r["database"], r["name"]) for r in TABLES[database]])
+        return iter(TABLES[database])
+
+    def disconnect(self):
+        pass
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncTables(unittest.TestCase):
+    def test_load(self):
+        # Tables and columns of both databases are queried at once
+        barrier = threading.Barrier(4, timeout=5)
+        with ThreadPoolExecutor(4) as executor:
+            loader = AsyncTables(lambda: FakeClient(barrier), executor)
+            tables = run(loader.load(["db1", "db2"]))
+        assert [str(t) for t in tables] == [
+            "db1.events",
+            "db1.merge",
+            "db2.users",
+        ]
+        # Columns of tables created between queries are skipped
+        assert [str(c) for c in tables["db1.events"].columns] == ["id"]
+        assert [str(c) for c in tables["db2.users"].columns] == ["id"]
+        assert tables["db1.merge"].rev_dependencies == ["db2.users"]
+        assert len(run(loader.load())) == 0
+
+    def test_load_hosts(self):
+        def broken():
+            raise ConnectionError("failed")
+
+        with self.assertLogs("clickhouse-plantuml", "ERROR"):
+            hosts = run(
+                load_hosts(
+                    {"ch1": FakeClient, "broken": broken, "ch2": FakeClient},
+                    ["db2"],
+                )
+            )
+        assert list(hosts) == ["ch1", "ch2"]
+        assert [str(t) for t in hosts["ch2"]] == ["db2.users"]
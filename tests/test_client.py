@@ -0,0 +1,185 @@
+import threading
+import unittest
+from unittest.mock import patch
+from clickhouse_plantuml import Column, Tables
+from clickhouse_plantuml import client as c
+from clickhouse_plantuml.sources import COLUMNS_FIELDS
+from .test_tables import FakeClient, column_row, table_row
+
+COLUMN_TYPES = [(name, "String") for name in COLUMNS_FIELDS]
+ROWS = [
+    ("db", "table_{}".format(i // 50), "column_{}".format(i), "String")
+    + ("",) * 4
+    + (0, 1, 1, 0)
+    for i in range(10000)
+]
+
+
+def enumerate_dicts(columns, rows):
+    """
+    The former implementation of Client.execute_iter_dict
+    """
+    for r in rows:
+        yield {columns[i][0]: v for i, v in enumerate(r)}
+
+
+class TestClient(unittest.TestCase):
+    def setUp(self):
+        self.client = c.Client("localhost")
+        patcher = patch.object(
+            self.client,
+            "execute_iter",
+            side_effect=lambda *a, **kw: iter([COLUMN_TYPES] + ROWS),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_row_factories(self):
+        query = "SELECT * FROM system.columns"
+        row = next(self.client.execute_iter_dict(query))
+        assert row == dict(zip(COLUMNS_FIELDS, ROWS[0]))
+        row = next(
+            self.client.execute_iter_rows(query, row_factory=c.tuple_row)
+        )
+        assert row == ROWS[0]
+        row = next(
+            self.client.execute_iter_rows(query, row_factory=c.namedtuple_row)
+        )
+        assert row.table == "table_0"
+        assert row == ROWS[0]
+        row = next(
+            self.client.execute_iter_rows(
+                query, row_factory=c.constructor_row(Column)
+            )
+        )
+        assert isinstance(row, Column)
+        assert row.as_dict() == dict(zip(COLUMNS_FIELDS, ROWS[0]))
+        # The same dictionaries as the former implementation
+        assert list(self.client.execute_iter_dict(query)) == list(
+            enumerate_dicts(COLUMN_TYPES, ROWS)
+        )
+        rows = self.client.execute_iter_rows(query, row_factory=c.tuple_row)
+        assert list(rows) == ROWS
+
+    def test_constructor_row_keywords(self):
+        def constructor(a, b):
+            return a, b
+
+        make_row = c.constructor_row(constructor)(["b", "a"])
+        assert make_row((1, 2)) == (2, 1)
+
+
+class PoolClient(FakeClient):
+    """
+    Fake client failing the first `failures` queries as a broken connection
+    """
+
+    def __init__(self, *results, failures=0):
+        super().__init__(*results)
+        self.failures = failures
+        self.disconnects = 0
+
+    def execute_iter_rows(self, query, params=None, row_factory=None):
+        if self.failures:
+            self.failures -= 1
+            raise EOFError("Unexpected EOF while reading bytes")
+        yield from super().execute_iter_rows(query, params, row_factory)
+
+    def disconnect(self):
+        self.disconnects += 1
+
+
+class CatalogClient(PoolClient):
+    """
+    Fake client answering by the query text, so the order of queries from
+    concurrent threads does not matter
+    """
+
+    def execute_iter_rows(self, query, params=None, row_factory=None):
+        self.queries.append((query, params))
+        if "system.columns" in query:
+            return iter([column_row("db", "t", "c")])
+        return iter([table_row("db", "t")])
+
+
+class TestClientPool(unittest.TestCase):
+    def test_checkout(self):
+        pool = c.ClientPool(size=2, timeout=0.01)
+        pool.factory = PoolClient
+        with pool.connection() as first, pool.connection() as second:
+            assert first is not second
+            with self.assertRaises(TimeoutError):
+                with pool.connection():
+                    pass
+        # The most recently used client is reused
+        with pool.connection() as client:
+            assert client is first
+
+        with self.assertRaises(ValueError):
+            with pool.connection() as client:
+                raise ValueError("failed")
+        assert client.disconnects == 1
+        # The failed client is returned into the pool
+        with pool.connection() as same:
+            assert same is client
+
+        pool.max_idle = 0
+        with pool.connection() as client:
+            assert client.disconnects == 2
+        pool.disconnect()
+        assert (first.disconnects, second.disconnects) == (3, 1)
+
+    def test_retry(self):
+        pool = c.ClientPool(size=1)
+        client = PoolClient([(1,), (2,)], [(3,)], failures=1)
+        pool.factory = lambda: client
+        assert list(pool.execute_iter_rows("SELECT 1")) == [(1,), (2,)]
+        assert client.disconnects == 1
+        assert len(client.queries) == 1
+
+        # Partially read rows leave the connection in the middle of a query
+        rows = pool.execute_iter_rows("SELECT 1")
+        assert next(rows) == (3,)
+        rows.close()
+        assert client.disconnects == 2
+
+        client.failures = 2
+        with self.assertRaises(EOFError):
+            list(pool.execute_iter_rows("SELECT 1"))
+        # The only client is returned into the pool anyway
+        pool.timeout = 0
+        with pool.connection() as same:
+            assert same is client
+
+    def test_tables(self):
+        clients = []
+
+        def factory():
+            clients.append(CatalogClient())
+            return clients[-1]
+
+        pool = c.ClientPool(size=2)
+        pool.factory = factory
+        barrier = threading.Barrier(2)
+        results = [None, None]
+        errors = []
+
+        def load(i):
+            try:
+                with pool.connection():
+                    # Both clients are checked out at once
+                    barrier.wait(timeout=5)
+                results[i] = [Tables(pool, ["db"]) for _ in range(10)]
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=load, args=(i,)) for i in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert errors == []
+        assert len(clients) == 2
+        for tables in results[0] + results[1]:
+            assert [str(t) for t in tables] == ["db.t"]
+            assert [str(c) for c in tables["db.t"].columns] == ["c"]
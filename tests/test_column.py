@@ -0,0 +1,44 @@
+import tracemalloc
+import unittest
+from clickhouse_plantuml import Column
+
+ROW = ("db", "table", "name", "String", "", "", "", "", 0, 1, 1, 0)
+
+
+class DictColumn(object):
+    """
+    Column with instance dictionary, as it was before __slots__
+    """
+
+    def __init__(self, *args):
+        for k, v in zip(Column.__slots__, args):
+            setattr(self, k, v)
+
+
+def allocated(factory, number: int) -> int:
+    tracemalloc.start()
+    try:
+        objects = [factory(*ROW) for _ in range(number)]
+        size = tracemalloc.get_traced_memory()[0]
+        del objects
+    finally:
+        tracemalloc.stop()
+    return size
+
+
+class TestColumn(unittest.TestCase):
+    def test_column(self):
+        column = Column(*ROW)
+        assert column.db_table == "db.table"
+        assert str(column) == "name"
+        assert column.as_dict() == dict(zip(Column.__slots__, ROW))
+        with self.assertRaises(AttributeError):
+            column.unknown = 1
+
+    def test_memory_benchmark(self):
+        number = 10000
+        slots = allocated(Column, number)
+        dicts = allocated(DictColumn, number)
+        # The gain depends on the python version, instance dictionaries are
+        # much more compact since 3.11
+        assert slots < dicts * 0.9, (slots, dicts)
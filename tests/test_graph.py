@@ -0,0 +1,87 @@
+import unittest
+from clickhouse_plantuml import DependencyGraph, Table, Tables
+from clickhouse_plantuml.graph import split_tables
+from clickhouse_plantuml.plantuml import gen_tables_dependencies
+
+
+def table(name, engine="MergeTree", engine_full="MergeTree()", deps=()):
+    t = Table("db", name, list(deps), "", engine, engine_full, "", "", "", "")
+    t.parse_engine()
+    return t
+
+
+class TestDependencyGraph(unittest.TestCase):
+    def setUp(self):
+        self.tables = Tables(None)
+        self.tables.extend(
+            [
+                # The local table knows about Distributed and the other way
+                table("events", deps=["db.events_dist", "db.mv"]),
+                table(
+                    "events_dist",
+                    "Distributed",
+                    "Distributed('cluster', 'db', 'events', rand())",
+                ),
+                table(
+                    "buffer",
+                    "Buffer",
+                    "Buffer(db, events, 16, 1, 2, 3, 4, 5, 6)",
+                ),
+                table("mv", "MaterializedView", ""),
+                # Dependencies out of the tables are skipped
+                table("lonely", deps=["other.table"]),
+            ]
+        )
+
+    def test_graph(self):
+        graph = DependencyGraph(self.tables)
+        assert list(graph) == [
+            ("db.events", "db.events_dist"),
+            ("db.events", "db.mv"),
+            ("db.buffer", "db.events"),
+        ]
+        assert len(graph) == 3
+        assert ("db.buffer", "db.events") in graph
+        assert graph.successors["db.events"] == ["db.events_dist", "db.mv"]
+        assert graph.predecessors["db.events"] == ["db.buffer"]
+        assert "db.lonely" in graph.nodes
+        assert "db.lonely" not in graph.successors
+        assert graph.add_edge("db.mv", "db.lonely")
+        assert not graph.add_edge("db.mv", "db.lonely")
+        assert graph.successors["db.mv"] == ["db.lonely"]
+
+    def test_gen_tables_dependencies(self):
+        assert gen_tables_dependencies(self.tables) == (
+            "db.events -|> db.events_dist\n"
+            "db.events -|> db.mv\n"
+            "db.buffer -|> db.events\n"
+        )
+
+    def test_split(self):
+        graph = DependencyGraph(self.tables)
+        assert graph.components() == [
+            ["db.events", "db.events_dist", "db.mv", "db.buffer"],
+            ["db.lonely"],
+        ]
+        assert graph.split(0) == [list(graph.nodes)]
+        assert graph.split(5) == [list(graph.nodes)]
+        assert graph.split(4) == [
+            ["db.events", "db.events_dist", "db.buffer", "db.mv"],
+            ["db.lonely"],
+        ]
+        # The big component is cut in breadth-first order
+        assert graph.split(2) == [
+            ["db.events", "db.events_dist"],
+            ["db.buffer", "db.mv"],
+            ["db.lonely"],
+        ]
+        parts = split_tables(self.tables, 3)
+        assert [len(p) for p in parts] == [3, 2]
+        assert parts[0]["db.mv"] is self.tables["db.mv"]
+        assert [str(t) for t in parts[1]] == ["db.buffer", "db.lonely"]
+
+    def test_split_many(self):
+        tables = Tables(None)
+        tables.extend(table("table_{}".format(i)) for i in range(20000))
+        parts = split_tables(tables, 100)
+        assert len(parts) == 200
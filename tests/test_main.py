@@ -0,0 +1,185 @@
+import json
+import os
+import unittest
+from argparse import Namespace
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from clickhouse_plantuml import DumpSource, Table, Tables
+from clickhouse_plantuml import __main__ as m
+from clickhouse_plantuml.plantuml import TableMemo
+from .test_tables import table_row
+
+
+class TestMain(unittest.TestCase):
+    def test_split_host(self):
+        assert m.split_host("localhost", 9000) == ("localhost", 9000)
+        assert m.split_host("ch1:9440", 9000) == ("ch1", 9440)
+        assert m.split_host("ch1:", 9000) == ("ch1:", 9000)
+
+    @patch.object(m, "get_tables")
+    def test_collect_tables(self, mock_get_tables):
+        def get_tables(args, host):
+            if host == "broken":
+                raise ConnectionError("failed")
+            return host
+
+        mock_get_tables.side_effect = get_tables
+        args = Namespace(
+            hosts=["ch2", "broken", "ch1"], concurrency=2, from_dump=None
+        )
+        with self.assertLogs(m.logger, "ERROR"):
+            result = m.collect_tables(args)
+        # Failed hosts are skipped, the order of hosts is kept
+        assert list(result.items()) == [("ch2", "ch2"), ("ch1", "ch1")]
+
+    def test_write_index(self):
+        output = StringIO()
+        m.write_index(
+            output,
+            [
+                ("part-1", "part-1.puml", "part-1.png", ["db.a", "db.b"]),
+                ("part-2", "part-2.puml", "", ["db.c"]),
+            ],
+        )
+        assert output.getvalue() == (
+            "# ClickHouse tables\n"
+            "\n## part-1\n\n"
+            "Source: [part-1.puml](part-1.puml)\n\n"
+            "![part-1.png](part-1.png)\n\n"
+            "- `db.a`\n"
+            "- `db.b`\n"
+            "\n## part-2\n\n"
+            "Source: [part-2.puml](part-2.puml)\n\n"
+            "- `db.c`\n"
+        )
+
+    def test_generate_split(self):
+        rows = [table_row("db", "a"), table_row("db", "b")]
+        tables = Tables(DumpSource([json.dumps(r) for r in rows], []), ["db"])
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "diagram.puml")
+            argv = ["clickhouse-plantuml", "--split", "1", "-o", path]
+            with patch.object(m.sys, "argv", argv):
+                args = m.parse_args()
+            args.hosts = ["ch1"]
+            m.generate(args, {"ch1": tables}, TableMemo())
+            args.text_output.close()
+            # The text output is not the place for the Markdown, it includes
+            # the parts instead
+            with open(path) as f:
+                assert f.read() == (
+                    "@startuml\n!include diagram.part-1.puml\n@enduml\n"
+                    "@startuml\n!include diagram.part-2.puml\n@enduml\n"
+                )
+            with open(os.path.join(tmp, "diagram.index.md")) as f:
+                index = f.read()
+            assert index.startswith("# ClickHouse tables\n")
+            assert "Source: [diagram.part-1.puml](diagram.part-1.puml)" in index
+            assert os.path.isfile(os.path.join(tmp, "diagram.part-2.puml"))
+
+            args.text_output = StringIO()
+            with patch.object(m.sys, "stdout", args.text_output), patch.object(
+                m, "part_output_name", lambda args, name: os.devnull
+            ):
+                m.generate(args, {"ch1": tables}, TableMemo())
+            assert args.text_output.getvalue().startswith("# ClickHouse")
+
+
+class FakeClient(object):
+    def __init__(self, fingerprints):
+        self.fingerprints = fingerprints
+        self.params = []
+
+    def execute_iter_rows(self, query, params=None, row_factory=None):
+        self.params.append(params)
+        result = self.fingerprints.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return iter(result)
+
+    def disconnect(self):
+        pass
+
+
+class TestWatcher(unittest.TestCase):
+    @patch.object(m, "generate")
+    @patch.object(m, "get_tables")
+    @patch.object(m, "make_client")
+    def test_poll(self, mock_make_client, mock_get_tables, mock_generate):
+        row = {"database": "db", "tables": 3, "mtime": 1600000000}
+        changed = dict(row, mtime=1600000100)
+        client = FakeClient(
+            [
+                [row],
+                [row],
+                ConnectionError("failed"),
+                ConnectionError(),
+                [changed],
+            ]
+        )
+        mock_make_client.return_value = client
+        mock_get_tables.return_value = ["db.table"]
+        args = Namespace(
+            hosts=["ch1"],
+            databases=["db"],
+            tables=[],
+            patterns=None,
+            focus=[],
+            text_output=StringIO(),
+            interval=10,
+            max_backoff=25,
+        )
+        watcher = m.Watcher(args)
+        assert watcher.poll()
+        mock_generate.assert_called_once_with(
+            args, {"ch1": ["db.table"]}, watcher.memo, None, None
+        )
+        assert not watcher.poll()
+        assert watcher.delay() == 10
+        mock_get_tables.assert_called_once_with(args, "ch1", client)
+
+        with self.assertLogs(m.logger, "ERROR"):
+            assert not watcher.poll()
+            assert watcher.delay() == 20
+            assert not watcher.poll()
+            assert watcher.delay() == 25
+        assert watcher.poll()
+        assert watcher.delay() == 10
+        assert mock_generate.call_count == 2
+        # Weeks of failures do not overflow
+        watcher.failures = 5000
+        assert watcher.delay() == 25
+
+    @patch.object(m, "generate")
+    @patch.object(m, "get_tables")
+    @patch.object(m, "make_client")
+    def test_poll_focus(self, mock_make_client, mock_get_tables, mock_generate):
+        row = {"database": "db", "tables": 3, "mtime": 1600000000}
+        other = {"database": "other", "tables": 1, "mtime": 1600000000}
+        changed = dict(other, mtime=1600000100)
+        client = FakeClient([[row], [row, other], [row, other], [row, changed]])
+        mock_make_client.return_value = client
+        tables = Tables(None)
+        tables.extend(
+            Table(**table_row(*n.split("."))) for n in ("db.a", "other.b")
+        )
+        mock_get_tables.return_value = tables
+        args = Namespace(
+            hosts=["ch1"],
+            databases=[],
+            tables=["ignored"],
+            patterns=None,
+            focus=["db.a"],
+            text_output=StringIO(),
+            interval=10,
+            max_backoff=25,
+        )
+        watcher = m.Watcher(args)
+        assert watcher.poll()
+        # The neighbour's database is fingerprinted after the load
+        assert client.params[:2] == [{"ds": ("db",)}, {"ds": ("db", "other")}]
+        assert not watcher.poll()
+        assert client.params[2] == {"ds": ("db", "other")}
+        assert watcher.poll()
+        assert mock_generate.call_count == 2
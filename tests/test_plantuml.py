@@ -1,7 +1,11 @@
 import unittest
+from io import StringIO
 from unittest.mock import patch
 from clickhouse_plantuml import plantuml as p
 
+COLUMN = ("test_database", "test_table", "name", "String")
+COLUMN += ("",) * 4 + (0, 1, 1, 0)
+
 
 class DummyColumn(p.Column):
     def __init__(self):
@@ -39,6 +43,15 @@ class TestPlantuml(unittest.TestCase):
             p.plantuml_tables([]) == p.plantuml_header() + p.plantuml_footer()
         )
 
+    def test_write_plantuml_tables(self):
+        output = StringIO()
+        p.write_plantuml_tables(self.test_tables, output)
+        assert output.getvalue() == p.plantuml_tables(self.test_tables)
+        chunks = list(p.iter_plantuml_tables(self.test_tables))
+        assert chunks[0] == p.plantuml_header()
+        assert chunks[1] == p.gen_table(self.test_table)
+        assert chunks[-1] == p.plantuml_footer()
+
     def test_plantuml_header(self):
         assert p.plantuml_header() == (
             "@startuml\n"
@@ -175,3 +188,41 @@ class TestPlantuml(unittest.TestCase):
             " <size:15><&collapse-down></size>"
             " "
         )
+
+    def test_table_memo(self):
+        memo = p.TableMemo(max_size=2)
+        block = p.gen_table(self.test_table)
+        assert memo.render(self.test_table) == block
+        assert memo.render(self.test_table) == block
+        assert (memo.hits, memo.misses) == (1, 1)
+        assert p.plantuml_tables(self.test_tables, memo) == (
+            p.plantuml_tables(self.test_tables)
+        )
+        assert memo.hits == 2
+
+        # Any change of the schema renders the table again
+        self.test_table.add_column(p.Column(*COLUMN))
+        assert memo.render(self.test_table) == p.gen_table(self.test_table)
+        assert (memo.misses, len(memo)) == (2, 2)
+        self.test_table.sorting_key = "date, name"
+        memo.render(self.test_table)
+        # The least recently used block is evicted
+        assert (memo.misses, len(memo)) == (3, 2)
+
+    def test_table_memo_tables(self):
+        tables = p.Tables(None)
+        for i in range(300):
+            data = dict(self.test_table_data, name="table_{}".format(i))
+            table = p.Table(**data)
+            table.parse_engine()
+            for j in range(30):
+                column = list(COLUMN)
+                column[1:3] = [table.name, "column_{}".format(j)]
+                table.add_column(p.Column(*column))
+            tables.append(table)
+
+        memo = p.TableMemo()
+        assert p.gen_tables(tables, memo) == p.gen_tables(tables)
+        # Unchanged tables are taken from the memo
+        assert p.gen_tables(tables, memo) == p.gen_tables(tables)
+        assert memo.misses == len(tables)
@@ -0,0 +1,97 @@
+import os
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+from clickhouse_plantuml import render as r
+
+# Mimics `plantuml -pipe -pipedelimitor DELIMITER -tFORMAT`: "renders" each
+# diagram as the format and the diagram lines count
+FAKE_PLANTUML = """
+import sys
+delimiter, fmt = sys.argv[sys.argv.index("-pipedelimitor") + 1], sys.argv[-1]
+lines = 0
+for line in sys.stdin:
+    lines += 1
+    if line.startswith("@enduml"):
+        sys.stdout.write("{}:{}\\n{}\\n".format(fmt, lines, delimiter))
+        sys.stdout.flush()
+        lines = 0
+"""
+COMMAND = (sys.executable, "-c", FAKE_PLANTUML)
+
+
+class TestRender(unittest.TestCase):
+    def test_plantuml(self):
+        with r.PlantUML("svg", command=COMMAND) as plantuml:
+            assert plantuml.render("@startuml\n@enduml\n") == b"-tsvg:2\n"
+            pid = plantuml._proc.pid
+            assert plantuml.render("@startuml\na\n@enduml") == b"-tsvg:3\n"
+            # The process is reused
+            assert plantuml._proc.pid == pid
+        assert plantuml._proc is None
+
+    def test_render_pool(self):
+        diagram = "@startuml\n@enduml\n"
+        with r.RenderPool(2, command=COMMAND) as pool:
+            futures = [
+                pool.submit(diagram, f) for f in ("png", "svg", "png", "svg")
+            ]
+            assert [f.result() for f in futures] == [
+                b"-tpng:2\n",
+                b"-tsvg:2\n",
+                b"-tpng:2\n",
+                b"-tsvg:2\n",
+            ]
+            # At most one process per worker and format
+            assert len(pool._processes) <= 4
+        assert pool._processes == []
+
+
+class TestRenderCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.cache = r.RenderCache(os.path.join(self.tmp.name, "cache"), 10)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_key(self):
+        key = r.RenderCache.key("diagram", "png")
+        assert key == r.RenderCache.key("diagram", "png", [])
+        assert key != r.RenderCache.key("diagram", "svg")
+        assert key != r.RenderCache.key("diagram", "png", ["-DPLANTUML"])
+        assert key != r.RenderCache.key("another diagram", "png")
+
+    def test_get_put_copy(self):
+        assert self.cache.get("key") is None
+        path = self.cache.put("key", b"data")
+        assert self.cache.get("key") == path
+        destination = os.path.join(self.tmp.name, "diagram.png")
+        self.cache.copy("key", destination)
+        self.cache.copy("key", destination)
+        with open(destination, "rb") as f:
+            assert f.read() == b"data"
+        # The output does not share the file with the cache
+        assert not os.path.samefile(path, destination)
+        with open(destination, "ab") as f:
+            f.write(b" changed")
+        with open(path, "rb") as f:
+            assert f.read() == b"data"
+        assert sorted(os.listdir(self.tmp.name)) == sorted(
+            ["diagram.png", os.path.basename(self.cache.directory)]
+        )
+
+    def test_evict(self):
+        self.cache.put("old", b"1234")
+        self.cache.put("used", b"1234")
+        os.utime(self.cache.path("old"), (1, 1))
+        os.utime(self.cache.path("used"), (2, 2))
+        # The used one is the most recent now
+        assert self.cache.get("used") is not None
+        self.cache.put("new", b"1234")
+        assert self.cache.get("old") is None
+        assert self.cache.get("used") is not None
+        assert self.cache.get("new") is not None
+        # The diagram bigger than the cache is kept alone
+        self.cache.put("huge", b"0123456789abcdef")
+        assert os.listdir(self.cache.directory) == ["huge"]
@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import unittest
+from http.client import HTTPConnection
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from clickhouse_plantuml import DumpSource
+from clickhouse_plantuml import server as s
+from clickhouse_plantuml.render import RenderCache, RenderPool
+from .test_render import COMMAND
+from .test_tables import table_row
+
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        rows = [
+            dict(table_row("db", "src"), dependencies=["db.dist"]),
+            table_row(
+                "db", "dist", "Distributed", "Distributed(c, db, src, rand())"
+            ),
+            table_row("other", "table"),
+        ]
+        self.source = DumpSource([json.dumps(r) for r in rows], [])
+        self.tmp = TemporaryDirectory()
+        self.renderer = RenderPool(1, command=COMMAND)
+        self.cache = RenderCache(os.path.join(self.tmp.name, "cache"))
+        self.diagrams = s.Diagrams(self.source, self.renderer, self.cache)
+        self.server = s.DiagramServer(("127.0.0.1", 0), self.diagrams)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(self.renderer.close)
+        self.addCleanup(self.tmp.cleanup)
+
+    def get(self, path, headers={}):
+        conn = HTTPConnection(*self.server.server_address[:2])
+        try:
+            conn.request("GET", path, headers=headers)
+            response = conn.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            conn.close()
+
+    def test_formats(self):
+        with self.assertLogs(s.logger, "INFO"):
+            status, headers, body = self.get("/database/db.puml")
+        assert status == 200
+        assert headers["Content-Type"] == s.CONTENT_TYPES["puml"]
+        assert b"Table(db.src)" in body
+        assert b"other.table" not in body
+
+        with self.assertLogs(s.logger, "INFO"):
+            status, headers, body = self.get("/focus/other.table.svg")
+        assert status == 200
+        assert headers["Content-Type"] == "image/svg+xml"
+        assert body.startswith(b"-tsvg:")
+
+        with self.assertLogs(s.logger, "INFO"):
+            assert self.get("/database/db.pdf")[0] == 404
+            assert self.get("/database/missing.puml")[0] == 404
+            assert self.get("/focus/db.src.png?depth=x")[0] == 400
+
+    def test_caches(self):
+        with self.assertLogs(s.logger, "INFO"), patch.object(
+            self.source, "get_tables", wraps=self.source.get_tables
+        ) as get_tables, patch.object(
+            self.renderer, "render", wraps=self.renderer.render
+        ) as render:
+            status, headers, body = self.get("/database/db.png")
+            assert status == 200
+            etag = headers["ETag"]
+            # Tables are taken from the TTL cache, the image is not rendered
+            status, headers, _ = self.get(
+                "/database/db.png", {"If-None-Match": etag}
+            )
+            assert status == 304
+            assert headers["ETag"] == etag
+            status, _, cached = self.get("/database/db.png")
+            assert (status, cached) == (200, body)
+            assert get_tables.call_count == 1
+            assert render.call_count == 1
+
+            # Expired tables are queried again, the image is the same
+            self.diagrams.ttl = 0
+            status, headers, _ = self.get(
+                "/database/db.png", {"If-None-Match": etag}
+            )
+            assert status == 304
+            assert get_tables.call_count == 2
+            assert render.call_count == 1
+
+    def test_memo_lock(self):
+        diagram = self.diagrams.diagram("database", "db")
+        result = []
+        # Generating of another diagram does not block cached ones
+        with self.diagrams._memo_lock:
+            thread = threading.Thread(
+                target=lambda: result.append(
+                    self.diagrams.diagram("database", "db")
+                )
+            )
+            thread.start()
+            thread.join(5)
+            assert result == [diagram]
@@ -0,0 +1,139 @@
+import unittest
+from clickhouse_plantuml import DumpSource, Tables
+from clickhouse_plantuml import sources as s
+
+TABLES_TSV = [
+    "database\tname\tengine\tengine_full\tdependencies_database\t"
+    "dependencies_table\tcreate_table_query\tmetadata_modification_time\t"
+    "sorting_key\n",
+    "db\tsrc\tMergeTree\tMergeTree ORDER BY id\t['db']\t['mv']\t"
+    "CREATE TABLE db.src\\n(id UInt64)\t2020-01-01 00:00:00\tid\n",
+    "db\tbuf\tBuffer\tBuffer(\\'db\\', \\'src\\', 16, 1, 2, 3, 4, 5, 6)\t[]\t"
+    "[]\tCREATE TABLE db.buf\t1577836800\t\n",
+    "other\tsrc\tMemory\tMemory\t[]\t[]\tCREATE TABLE other.src\t0\t\n",
+]
+
+COLUMNS_JSON = [
+    '{"database":"db","table":"src","name":"id","type":"UInt64",'
+    '"is_in_sorting_key":1}\n',
+    '{"database":"db","table":"buf","name":"id","type":"UInt64"}\n',
+    "\n",
+    '{"database":"other","table":"src","name":"id","type":"UInt64"}\n',
+]
+
+
+class TestDumpSource(unittest.TestCase):
+    def setUp(self):
+        self.source = DumpSource(TABLES_TSV, COLUMNS_JSON)
+
+    def test_read_dump(self):
+        rows = list(s.read_dump(TABLES_TSV))
+        # Arrays are parsed only for known columns by DumpSource
+        assert rows[0]["dependencies_table"] == "['mv']"
+        assert (
+            rows[0]["create_table_query"] == "CREATE TABLE db.src\n(id UInt64)"
+        )
+        assert rows[1]["dependencies_table"] == "[]"
+        assert rows[1]["engine_full"].startswith("Buffer('db', 'src', 16")
+        assert len(list(s.read_dump(COLUMNS_JSON))) == 3
+        assert list(s.read_dump([])) == []
+
+    def test_tsv_strings(self):
+        columns = [
+            "database\ttable\tname\ttype\tdefault_kind\t"
+            "default_expression\tcomment\n",
+            "db\tsrc\ttags\tArray(String)\tDEFAULT\t[]\t['not', 'a list']\n",
+        ]
+        source = DumpSource(TABLES_TSV, columns)
+        column = list(source.get_columns([("db", "src")]))[0]
+        assert column[4:7] == ("DEFAULT", "[]", "['not', 'a list']")
+        assert source.tables[("db", "src")]["dependencies"] == ["db.mv"]
+
+    def test_source(self):
+        assert [r["name"] for r in self.source.get_tables(["db"])] == [
+            "buf",
+            "src",
+        ]
+        assert [r["name"] for r in self.source.get_tables(["db"], ["src"])] == [
+            "src"
+        ]
+        metadata = list(self.source.get_metadata(["db"]))
+        assert [m["mtime"] for m in metadata] == [1577836800] * 2
+        assert metadata[1]["dependencies"] == ["db.mv"]
+        columns = list(self.source.get_columns([("db", "src")]))
+        assert len(columns) == 1
+        assert columns[0][:4] == ("db", "src", "id", "UInt64")
+        # is_in_sorting_key and is_in_primary_key
+        assert columns[0][9:11] == (1, 0)
+        assert list(self.source.get_table_names(["other"])) == [
+            ("other", "src")
+        ]
+
+    def test_tables(self):
+        tables = Tables(self.source, ["db", "other"])
+        assert [str(t) for t in tables] == ["db.buf", "db.src", "other.src"]
+        assert tables["db.buf"].dependencies == ["db.src"]
+        assert [str(c) for c in tables["other.src"].columns] == ["id"]
+
+    def test_patterns(self):
+        patterns = s.Patterns(tables=["^s"], exclude=[r"^other\."])
+        assert [str(t) for t in Tables(self.source, patterns=patterns)] == [
+            "db.src"
+        ]
+        patterns = s.Patterns(databases=["^oth"])
+        assert [str(t) for t in Tables(self.source, patterns=patterns)] == [
+            "other.src"
+        ]
+
+
+class TestPatterns(unittest.TestCase):
+    def test_where(self):
+        patterns = s.Patterns(["^db"], ["^events_", "_local$"], [r"\.tmp_"])
+        where, params = patterns.where()
+        name = r"replaceRegexpOne(name, '^\\.inner\\.', '')"
+        assert where == (
+            "(match(database, %(dp0)s)) AND "
+            "(match({0}, %(tp0)s) OR match({0}, %(tp1)s)) AND "
+            "NOT (match(concat(database, '.', {0}), %(xp0)s))".format(name)
+        )
+        assert params == {
+            "dp0": "^db",
+            "tp0": "^events_",
+            "tp1": "_local$",
+            "xp0": r"\.tmp_",
+        }
+        assert patterns.key() == [
+            "d:^db",
+            "t:^events_",
+            "t:_local$",
+            r"x:\.tmp_",
+        ]
+        assert not s.Patterns()
+
+    def test_query(self):
+        source = s.ClickHouseSource(None)
+        where, params = source._tables_where(
+            [], None, s.Patterns(tables=["^events_"])
+        )
+        # No databases mean all of them if patterns are set
+        assert where.startswith("(match(")
+        where, params = source._tables_where(
+            ["db"], ["events"], s.Patterns(exclude=["tmp"])
+        )
+        assert where.startswith("database IN %(ds)s AND name IN %(ns)s AND ")
+        assert params["ns"] == ("events", ".inner.events")
+        # The same selection for system.columns
+        where, _ = source._tables_where(
+            ["db"], ["events"], s.Patterns(tables=["^e"]), "table"
+        )
+        assert "table IN %(ns)s" in where
+        assert "match(replaceRegexpOne(table, " in where
+
+    def test_match(self):
+        patterns = s.Patterns(["^db$"], ["^events_"], [r"_tmp$"])
+        assert patterns.match("db", "events_local")
+        # MV inner tables follow their views
+        assert patterns.match("db", ".inner.events_mv")
+        assert not patterns.match("db", ".inner.events_tmp")
+        assert not patterns.match("db2", "events_local")
+        assert not patterns.match("db", "users")
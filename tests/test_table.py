@@ -0,0 +1,99 @@
+import unittest
+from io import StringIO
+from token import tok_name
+from tokenize import generate_tokens
+from typing import List
+from clickhouse_plantuml import table as t
+
+ENGINES = [
+    "Memory",
+    "MergeTree() PARTITION BY toYYYYMM(date) ORDER BY date",
+    "ReplicatedReplacingMergeTree('/zk/node', 'replica_name', 'ver') "
+    "PARTITION BY date ORDER BY date",
+    "ReplicatedGraphiteMergeTree('/clickhouse/tables/graphite.data_lr/"
+    "{shard}', '{replica}', 'graphite_rollup') PARTITION BY "
+    "toYYYYMMDD(toStartOfInterval(Date, toIntervalDay(3))) ORDER BY "
+    "(Path, Time) SETTINGS index_granularity = 8192",
+    "Distributed('graphite_data', 'graphite', 'data_lr', cityHash64(Path))",
+    "Distributed(cluster, db, table, sipHash64(user_id, 'salt'), 'policy')",
+    "Buffer('db', 'table', 16, 10, 100, 10000, 1000000, 10000000, "
+    "100000000)",
+    "Merge('db', '^events_\\\\d+$')",
+    "MySQL('host:3306', 'db', 'table', 'user', 'it\\'s a password', 1)",
+    "Join(ANY, LEFT, id, date)",
+    "CollapsingMergeTree(sign) ORDER BY id",
+]
+
+
+def tokenize_engine_args(engine_full: str) -> List[str]:
+    """
+    The former tokenize based implementation of Table._parse_engine_config
+    """
+    tokens = generate_tokens(StringIO(engine_full).readline)
+    engine_args = []  # type: List[str]
+    stack = 0
+    for tok in tokens:
+        exact_type = tok_name[tok.exact_type]
+        if exact_type == "LPAR":
+            stack += 1
+            config_element = tok.string
+            if stack == 1:
+                continue
+        elif exact_type == "RPAR":
+            stack -= 1
+            config_element = tok.string
+            if stack == 0:
+                break
+        elif exact_type == "COMMA" and stack == 1:
+            engine_args.append("")
+            continue
+        elif exact_type == "STRING":
+            config_element = eval(tok.string)
+        else:
+            config_element = tok.string
+
+        if not stack:
+            continue
+
+        if not engine_args:
+            engine_args.append("")
+
+        engine_args[-1] += config_element
+
+    return engine_args
+
+
+class TestTable(unittest.TestCase):
+    def test_parse_engine_args_compatible(self):
+        for engine_full in ENGINES:
+            assert t.parse_engine_args(engine_full) == tokenize_engine_args(
+                engine_full
+            ), engine_full
+
+    def test_parse_engine_args(self):
+        assert t.parse_engine_args("Log") == []
+        assert t.parse_engine_args("MergeTree()") == []
+        assert t.parse_engine_args("f('')") == [""]
+        # Arguments of the expressions are not engine arguments
+        assert (
+            t.parse_engine_args(
+                "ReplacingMergeTree PARTITION BY toYYYYMM(date) ORDER BY id"
+            )
+            == []
+        )
+        assert t.parse_engine_args(
+            "E('a\\\\tb', 'it''s', '\\x41\\n', `quoted id`, \"x\"\"y\")"
+        ) == ["a\\tb", "it's", "A\n", "quoted id", 'x"y']
+        assert t.parse_engine_args("E('(,)', f(1, ')'), g(h()))") == [
+            "(,)",
+            "f(1,))",
+            "g(h())",
+        ]
+
+    def test_parse_engine_client(self):
+        table = t.Table(
+            "db", "merge", [], "", "Merge", "Merge(db, '^t')", "", "", "", ""
+        )
+        # The former client argument is accepted and ignored
+        table.parse_engine(object())
+        assert table.engine_config == [("database", "db"), ("table_re", "^t")]
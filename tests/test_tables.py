@@ -0,0 +1,313 @@
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+from clickhouse_plantuml import ClickHouseSource, DumpSource, Table, Tables
+from clickhouse_plantuml import tables as tables_module
+
+
+class FakeClient(object):
+    """
+    Returns the prepared results in the order of queries
+    """
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.queries = []
+        self.kwargs = []
+
+    def execute_iter_rows(self, query, params=None, row_factory=None, **kw):
+        self.queries.append((query, params))
+        self.kwargs.append(kw)
+        return iter(self.results.pop(0))
+
+    def execute_columnar(self, query, params=None, **kwargs):
+        self.queries.append((query, params))
+        self.kwargs.append(kwargs)
+        rows = self.results.pop(0)
+        if rows and isinstance(rows[0], dict):
+            names = list(rows[0])
+            rows = [tuple(r.values()) for r in rows]
+            return [list(f) for f in zip(*rows)], names
+        return [list(f) for f in zip(*rows)], []
+
+
+def table_row(database, name, engine="MergeTree", engine_full="MergeTree()"):
+    return {
+        "database": database,
+        "name": name,
+        "dependencies": [],
+        "create_table_query": "CREATE TABLE {}.{}".format(database, name),
+        "engine": engine,
+        "engine_full": engine_full,
+        "partition_key": "",
+        "sorting_key": "",
+        "primary_key": "",
+        "sampling_key": "",
+    }
+
+
+def column_row(database, table, name, type="String"):
+    return (database, table, name, type, "", "", "", "", 0, 0, 0, 0)
+
+
+class TestTables(unittest.TestCase):
+    def test_sequence(self):
+        tables = Tables(None)
+        a, b, c, d = (Table(**table_row("db", n)) for n in "abcd")
+        tables.extend([a, c])
+        tables.insert(1, b)
+        assert list(tables) == [a, b, c]
+        assert tables[1] is b and tables["db.b"] is b
+        assert tables[-2:] == [b, c]
+        assert b in tables and "db.b" in tables and d not in tables
+        tables[1] = d
+        assert list(tables) == [a, d, c]
+        tables.remove(d)
+        assert list(tables) == [a, c]
+        with self.assertRaises(ValueError):
+            tables.remove(d)
+        del tables["db.a"]
+        tables.append(b)
+        assert list(tables) == [c, b]
+        tables.reverse()
+        assert list(tables) == [b, c]
+        del tables[0]
+        assert list(tables) == [c] and len(tables) == 1
+
+    def test_lookup_logging(self):
+        tables = Tables(None)
+        tables._build_tables(
+            table_row("db", "table_{}".format(i)) for i in range(1000)
+        )
+        names = ["db.table_{}".format(i) for i in range(1000)]
+        # Even with the debug level lookups must not log or format anything
+        with patch.object(tables_module.logger, "debug") as debug:
+            tables_module.logger.setLevel("DEBUG")
+            try:
+                for name in names:
+                    tables[name]
+            finally:
+                tables_module.logger.setLevel("NOTSET")
+        debug.assert_not_called()
+
+    def test_merge_matviews_many(self):
+        rows = []
+        for i in range(40000):
+            rows.append(table_row("db", "table_{:05}".format(i)))
+        for i in range(5000):
+            rows.append(
+                table_row("db", "mv_{:05}".format(i), "MaterializedView", "")
+            )
+            rows.append(table_row("db", ".inner.mv_{:05}".format(i)))
+            mv = table_row("db", "to_mv_{:05}".format(i), "MaterializedView")
+            mv["create_table_query"] = (
+                "CREATE MATERIALIZED VIEW db.to_mv_{0:05} TO db.table_{0:05} "
+                "AS SELECT 1".format(i)
+            )
+            rows.append(mv)
+        tables = Tables(None)
+        tables._build_tables(rows)
+        assert len(tables) == 55000
+        tables._merge_matviews()
+        # 5k .inner. and 5k TO tables are removed
+        assert len(tables) == 45000
+        assert "db..inner.mv_00001" not in tables
+        assert "db.table_00001" not in tables
+        assert tables["db.to_mv_00001"].engine_config[0] == (
+            "data_table_name",
+            "db.table_00001",
+        )
+
+    def test_get_columns_pairs(self):
+        client = FakeClient(
+            [table_row("db1", "events"), table_row("db2", "users")],
+            [
+                column_row("db1", "events", "id"),
+                column_row("db2", "users", "id"),
+            ],
+        )
+        tables = Tables(client, ["db1", "db2"], ["events", "users"])
+        query, params = client.queries[1]
+        assert "(database, table) IN %(pairs)s" in query
+        assert params == {"pairs": (("db1", "events"), ("db2", "users"))}
+        assert [str(c) for c in tables["db1.events"].columns] == ["id"]
+        assert [str(c) for c in tables["db2.users"].columns] == ["id"]
+
+    def test_get_columns_of(self):
+        for columnar in (False, True):
+            client = FakeClient(
+                [table_row("db1", "events"), table_row("db2", "users")],
+                [
+                    column_row("db1", "events", "id"),
+                    # Created after tables were queried
+                    column_row("db1", "new", "id"),
+                    column_row("db2", "users", "id"),
+                    column_row("db2", "users", "name"),
+                ],
+            )
+            source = ClickHouseSource(client, columnar)
+            tables = Tables(source, ["db1", "db2"])
+            query, params = client.queries[1]
+            # The same selection as tables, no pairs
+            assert "database IN %(ds)s" in query
+            assert params == {"ds": ("db1", "db2")}
+            assert [str(t) for t in tables] == ["db1.events", "db2.users"]
+            assert [str(c) for c in tables["db1.events"].columns] == ["id"]
+            assert [str(c) for c in tables["db2.users"].columns] == [
+                "id",
+                "name",
+            ]
+
+    def test_external_pairs(self):
+        pairs = [("db", "t{:04}".format(i)) for i in range(2000)]
+        client = FakeClient([], [])
+        source = ClickHouseSource(client)
+        list(source.get_tables_by_pairs(pairs[:10]))
+        list(source.get_columns(pairs))
+        assert client.queries[0][1] == {"pairs": tuple(pairs[:10])}
+        assert client.kwargs[0] == {}
+        query, params = client.queries[1]
+        assert "(database, table) IN _pairs" in query
+        assert params == {}
+        external = client.kwargs[1]["external_tables"][0]
+        assert external["name"] == "_pairs"
+        assert external["data"][1] == {"database": "db", "table": "t0001"}
+        assert len(external["data"]) == 2000
+
+    def test_columnar(self):
+        client = FakeClient(
+            [table_row("db1", "events"), table_row("db1", "users")],
+            [
+                column_row("db1", "events", "id"),
+                column_row("db1", "events", "date", "Date"),
+                column_row("db1", "users", "id"),
+            ],
+        )
+        tables = Tables(ClickHouseSource(client, columnar=True), ["db1"])
+        assert [str(t) for t in tables] == ["db1.events", "db1.users"]
+        columns = tables["db1.events"].columns
+        assert [(c.name, c.type) for c in columns] == [
+            ("id", "String"),
+            ("date", "Date"),
+        ]
+        assert [c.db_table for c in tables["db1.users"].columns] == [
+            "db1.users"
+        ]
+
+    def test_resolve_merges(self):
+        client = FakeClient(
+            [
+                table_row("db1", "events_1"),
+                table_row("db1", "events_2"),
+                table_row("db1", "events", "Merge", "Merge(db1, '^events_')"),
+                table_row(
+                    "db1", "other", "Merge", "Merge('db2', 'other_\\\\d')"
+                ),
+            ],
+            [{"database": "db2", "name": n} for n in ("other_1", "others")],
+            [],
+        )
+        tables = Tables(client, ["db1"])
+        # Merge tables are resolved in one query for not loaded databases
+        assert len(client.queries) == 3
+        assert client.queries[1][1] == {"ds": ("db2",)}
+        assert tables["db1.events"].rev_dependencies == [
+            "db1.events_1",
+            "db1.events_2",
+        ]
+        assert tables["db1.other"].rev_dependencies == ["db2.other_1"]
+
+    def test_focus(self):
+        def mv(name, query):
+            row = table_row("db", name, "MaterializedView", "")
+            row["create_table_query"] = query
+            return row
+
+        rows = [
+            dict(table_row("db", "src"), dependencies=["db.mv", "db.mv2"]),
+            mv(
+                "mv",
+                "CREATE MATERIALIZED VIEW db.mv TO db.agg AS SELECT * FROM src",
+            ),
+            table_row("db", "agg"),
+            table_row(
+                "db",
+                "agg_dist",
+                "Distributed",
+                "Distributed('c', 'db', 'agg', rand())",
+            ),
+            # It mentions `agg` in the engine, but does not refer to it
+            table_row(
+                "db", "far", "Distributed", "Distributed(c, db, agg_dist)"
+            ),
+            table_row(
+                "db", "buf", "Buffer", "Buffer(db, src, 16, 1, 2, 3, 4, 5, 6)"
+            ),
+            mv("mv2", "CREATE MATERIALIZED VIEW db.mv2 AS SELECT * FROM src"),
+            table_row("db", ".inner.mv2"),
+            table_row("db", "unrelated"),
+        ]
+        source = DumpSource([json.dumps(r) for r in rows], [])
+
+        def focus(depth):
+            tables = Tables(source, focus=["db.agg"], depth=depth)
+            return sorted(t.name for t in tables)
+
+        # `agg` is merged into the MV created TO it
+        assert focus(0) == ["agg"]
+        assert focus(1) == ["agg_dist", "mv"]
+        assert focus(2) == ["agg_dist", "far", "mv", "src"]
+        # MV's .inner. table is fetched together with the MV
+        assert focus(3) == ["agg_dist", "buf", "far", "mv", "mv2", "src"]
+
+    def test_snapshot(self):
+        def metadata(name, mtime, dependencies=()):
+            return {
+                "database": "db",
+                "name": name,
+                "mtime": mtime,
+                "dependencies": list(dependencies),
+            }
+
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "snapshot.json")
+            client = FakeClient(
+                [metadata("a", 1), metadata("b", 1)],
+                [table_row("db", "a"), table_row("db", "b")],
+                [column_row("db", "a", "x"), column_row("db", "b", "y")],
+            )
+            tables = Tables(client, ["db"], snapshot=path)
+            assert [str(t) for t in tables] == ["db.a", "db.b"]
+            assert client.queries[1][1] == {"pairs": (("db", "a"), ("db", "b"))}
+
+            # b is changed, a got a new dependency, c is created, and the
+            # snapshot is used for the rest
+            client = FakeClient(
+                [
+                    metadata("a", 1, ["db.c"]),
+                    metadata("b", 2),
+                    metadata("c", 1),
+                ],
+                [table_row("db", "b"), table_row("db", "c")],
+                [column_row("db", "b", "z"), column_row("db", "c", "x")],
+            )
+            tables = Tables(client, ["db"], snapshot=path)
+            assert client.queries[1][1] == {"pairs": (("db", "b"), ("db", "c"))}
+            assert [str(t) for t in tables] == ["db.a", "db.b", "db.c"]
+            assert tables["db.a"].dependencies == ["db.c"]
+            assert [str(c) for c in tables["db.a"].columns] == ["x"]
+            assert [str(c) for c in tables["db.b"].columns] == ["z"]
+
+            # a is dropped, nothing else is fetched
+            client = FakeClient([metadata("b", 2), metadata("c", 1)])
+            tables = Tables(client, ["db"], snapshot=path)
+            assert len(client.queries) == 1
+            assert [str(t) for t in tables] == ["db.b", "db.c"]
+            assert [str(c) for c in tables["db.c"].columns] == ["x"]
+
+            # Another selection does not use the snapshot
+            client = FakeClient([metadata("b", 2)], [table_row("db", "b")], [])
+            tables = Tables(client, ["db"], ["b"], snapshot=path)
+            assert client.queries[1][1] == {"pairs": (("db", "b"),)}
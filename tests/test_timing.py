@@ -0,0 +1,104 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+from clickhouse_plantuml import Tables
+from clickhouse_plantuml import timing as t
+from .test_tables import FakeClient, column_row, table_row
+
+
+class TrackingClient(FakeClient):
+    """
+    Fake client with the driver's info of the last query
+    """
+
+    def execute_iter_rows(self, query, params=None, row_factory=None):
+        rows = super().execute_iter_rows(query, params, row_factory)
+        profile_info = SimpleNamespace(bytes=100)
+        self.last_query = SimpleNamespace(profile_info=profile_info)
+        return rows
+
+
+class TestProfiler(unittest.TestCase):
+    def test_spans(self):
+        profiler = t.Profiler()
+        with profiler.span("disabled"):
+            pass
+        assert profiler.iterate("disabled", [1]) == [1]
+        assert profiler.spans == {}
+
+        profiler.enabled = True
+        hooked = []
+        profiler.hooks.append(hooked.append)
+        for rows in (3, 5):
+            with profiler.span("phase") as span:
+                span.rows = rows
+        with self.assertRaises(ValueError), profiler.span("failed"):
+            raise ValueError("failed")
+        # Spans of the same name are summed up
+        assert list(profiler.spans) == ["phase", "failed"]
+        phase = profiler.spans["phase"]
+        assert (phase.calls, phase.rows) == (2, 8)
+        assert phase.seconds >= 0
+        # Hooks get every span
+        assert [(s.name, s.rows) for s in hooked] == [
+            ("phase", 3),
+            ("phase", 5),
+            ("failed", 0),
+        ]
+
+        profiler.hooks.append(lambda span: 1 / 0)
+        with self.assertLogs(t.logger, "WARNING"):
+            with profiler.span("hook failed"):
+                pass
+        assert "hook failed" in profiler.spans
+
+    def test_iterate(self):
+        profiler = t.Profiler(True)
+        finished = []
+        with patch.object(t, "perf_counter", side_effect=range(100)):
+            rows = profiler.iterate("query", "abc", finished.append)
+            assert next(rows) == "a"
+            # The consumer's time is not counted
+            t.perf_counter()
+            assert list(rows) == ["b", "c"]
+        span = profiler.spans["query"]
+        assert (span.calls, span.rows, span.seconds) == (1, 3, 4)
+        assert finished and finished[0].rows == 3
+
+    def test_report(self):
+        profiler = t.Profiler(True)
+        with profiler.span("phase") as span:
+            span.rows, span.bytes = 10, 1024
+        report = profiler.report().splitlines()
+        assert report[0].split() == [
+            "span",
+            "calls",
+            "seconds",
+            "rows",
+            "bytes",
+        ]
+        assert report[1].split()[:2] == ["phase", "1"]
+        assert report[1].split()[3:] == ["10", "1024"]
+        data = json.loads(profiler.report("json"))
+        assert data["spans"][0]["name"] == "phase"
+        assert data["peak_memory"] is None or data["peak_memory"] > 0
+
+    def test_tables(self):
+        client = TrackingClient(
+            [table_row("db", "a"), table_row("db", "b")],
+            [column_row("db", "a", "c1"), column_row("db", "b", "c2")],
+        )
+        # Tables and sources are measured by the module-level profiler
+        t.profiler.reset()
+        t.profiler.enabled = True
+        try:
+            Tables(client, ["db"])
+        finally:
+            t.profiler.enabled = False
+        spans = t.profiler.spans
+        t.profiler.reset()
+        assert spans["query system.tables"].rows == 2
+        assert spans["query system.tables"].bytes == 100
+        assert spans["query system.columns"].rows == 2
+        assert spans["parse_engine"].rows == 2